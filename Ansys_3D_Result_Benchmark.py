@@ -0,0 +1,336 @@
+####################################################################################################
+# Ansys_3D_Result_Benchmark.py
+#
+#      Purpose:  Times each stage of making a 3D result file from Ansys_3D_Result_Translator.py
+#                on made up (synthetic) hex and tet meshes, so we can see where the time goes
+#                and tell if a new version got slower.
+#
+#       Usage:  python Ansys_3D_Result_Benchmark.py --sizes 10k,100k,1M --out bench.json
+#               python Ansys_3D_Result_Benchmark.py --sizes 10k,100k --compare bench.json
+#               python Ansys_3D_Result_Benchmark.py --rst file.rst --set 1      (adds a real file)
+#
+####################################################################################################
+#
+#### SECTION 1 ####
+
+#1.1: The translator has all of the stages we want to time. It only opens its window when it is
+#       run as a program, so we can import it
+import Ansys_3D_Result_Translator as tr
+
+#1.2: numpy and pyvista to make the meshes, and the standard modules for timing and memory
+import numpy as np
+import pyvista as pv
+import os
+import sys
+import time
+import json
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+# Jump down to the main program for section 4!
+
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#
+#  ##### SECTION 2 #####
+#
+# Synthetic meshes and results. The translator works on DPF meshes and fields containers,
+#    but the stages we time only use a few things from them: the pyvista grid, the node
+#    coordinates, the node and element IDs, and the IDs, values and location of each field.
+#    So we make simple objects that have just those.
+#
+# 2.1: The simple mesh and field objects
+class SynthScoping:
+    def __init__(self,ids):
+        self.ids = ids
+
+class SynthField:
+    def __init__(self,location,ids,data):
+        self.location = location
+        self.scoping = SynthScoping(ids)
+        self.data = data
+
+class SynthEntities:
+    def __init__(self,ids,coords=None):
+        self.scoping = SynthScoping(ids)
+        self.n_nodes = len(ids)
+        self.n_elements = len(ids)
+        if coords is not None:
+            self.coordinates_field = SynthField(tr.dpf.locations.nodal,ids,coords)
+
+class SynthMesh:
+    def __init__(self,grid):
+        self.grid = grid
+        self.nodes = SynthEntities(np.arange(1,grid.n_points+1), np.asarray(grid.points, dtype=np.float64))
+        self.elements = SynthEntities(np.arange(1,grid.n_cells+1))
+
+# 2.2: The points of a block of n x n x n nodes, and the 8 corner nodes of each hex in it,
+#      in VTK order
+def blockPoints(n):
+    x = np.linspace(0.0, 1.0, n)
+    zz, yy, xx = np.meshgrid(x, x, x, indexing="ij")
+    points = np.column_stack((xx.ravel(), yy.ravel(), zz.ravel()))
+    i, j, k = np.meshgrid(np.arange(n-1), np.arange(n-1), np.arange(n-1), indexing="ij")
+    n0 = (i*n*n + j*n + k).ravel()
+    dx, dy, dz = 1, n, n*n
+    hexes = np.column_stack((n0, n0+dx, n0+dx+dy, n0+dy,
+                             n0+dz, n0+dx+dz, n0+dx+dy+dz, n0+dy+dz))
+    return points, hexes
+
+# 2.3: Make a hex or tet grid with about the number of nodes asked for.
+#      For tets, each hex is split into 6 tets that all share its long diagonal,
+#      so the tets of neighboring hexes line up
+kuhnTets = np.array([[0,1,2,6], [0,1,5,6], [0,3,2,6], [0,3,7,6], [0,4,5,6], [0,4,7,6]])
+
+def makeGrid(nnode,kind):
+    n = max(2, int(round(nnode**(1.0/3.0))))
+    points, hexes = blockPoints(n)
+    if kind == "hex":
+        conn = hexes
+        ctype = pv.CellType.HEXAHEDRON
+    else:
+        conn = hexes[:,kuhnTets].reshape(-1,4)
+        ctype = pv.CellType.TETRA
+    npc = conn.shape[1]
+    cells = np.hstack((np.full((len(conn),1), npc, dtype=np.int64), conn)).ravel()
+    celltypes = np.full(len(conn), ctype, dtype=np.uint8)
+    return pv.UnstructuredGrid(cells, celltypes, points)
+
+# 2.4: Made up results on the grid: a bending displacement, a nodal "stress" that changes
+#      smoothly, and an elemental one. The model is split into two bodies so the merge of
+#      more than one field gets timed too
+def makeResults(mesh):
+    pts = mesh.nodes.coordinates_field.data
+    nids = mesh.nodes.scoping.ids
+    eids = mesh.elements.scoping.ids
+    disp = np.column_stack((0.01*pts[:,2]**2, 0.02*pts[:,0]*pts[:,2], 0.05*np.sin(np.pi*pts[:,0])))
+    nval = 100.0*np.sin(2.0*pts[:,0])*np.cos(3.0*pts[:,1]) + 50.0*pts[:,2]
+    eval = np.linspace(0.0, 1.0, len(eids))
+
+    def twoBodies(location,ids,data):
+        half = len(ids)//2
+        return [SynthField(location,ids[:half+1],data[:half+1]), SynthField(location,ids[half:],data[half:])]
+
+    return {"u":twoBodies(tr.dpf.locations.nodal,nids,disp),
+            "nodal":twoBodies(tr.dpf.locations.nodal,nids,nval),
+            "elemental":twoBodies(tr.dpf.locations.elemental,eids,eval)}
+
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#
+#  ##### SECTION 3 #####
+#
+# Timing the stages. Each stage is run on its own: wall clock time, CPU time, and the peak
+#    memory numpy and python asked for while it ran (from tracemalloc). Each stage is run
+#    "repeat" times and the fastest run is kept, since that is the one with the least noise.
+#
+# 3.1: Time one stage. fn() does the work and returns anything the next stage needs
+def timeStage(results,meta,stage,fn,repeat):
+    best = None
+    for r in range(repeat):
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        cpu0 = time.process_time()
+        wall0 = time.perf_counter()
+        value = fn()
+        wall = time.perf_counter() - wall0
+        cpu = time.process_time() - cpu0
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        if best is None or wall < best["wall_s"]:
+            best = {"wall_s":wall, "cpu_s":cpu, "peak_mb":peak/1024/1024}
+    rec = dict(meta)
+    rec["stage"] = stage
+    rec.update(best)
+    results.append(rec)
+    print("  %-22s %9.4f s wall %9.4f s cpu %10.1f MB peak" %
+          (stage, best["wall_s"], best["cpu_s"], best["peak_mb"]), flush=True)
+    return value
+
+# 3.2: Run every stage on one synthetic mesh. The stages follow createResultFile():
+#      the mesh/grid build (what DPF does in mesh.grid), the result extraction, the extents and
+#      max deflection, the distortion, the surface, then each output type
+def benchMesh(results,kind,nnode,repeat,outDir):
+    grid = timeStage(results,{"mesh":kind,"target_nodes":nnode},"grid",lambda: makeGrid(nnode,kind),1)
+    meta = {"mesh":kind, "target_nodes":nnode, "nodes":grid.n_points, "elements":grid.n_cells}
+    results[-1].update(meta)
+    mesh = SynthMesh(grid)
+    res = makeResults(mesh)
+    cached = {"path":"synthetic", "mesh":mesh, "derived":{}, "nbytes":0}
+
+# 3.2.1: Pull the results into mesh aligned arrays, with every body merged
+    timeStage(results,meta,"extract_nodal",lambda: tr.gatherField(res["nodal"],cached),repeat)
+    timeStage(results,meta,"extract_elemental",lambda: tr.gatherField(res["elemental"],cached),repeat)
+
+# 3.2.2: The model extents and the biggest deflection, then the scale factor
+    coords = tr.cachedCoords(cached)
+    def extents():
+        dltmax = float(np.max(coords.max(axis=0)-coords.min(axis=0)))
+        umax = tr.maxDeflection(res["u"])
+        return dltmax, umax
+    dltmax, umax = timeStage(results,meta,"extents",extents,repeat)
+    sclfact = 5.0/100.0*dltmax/umax
+
+# 3.2.3: Distort every node of the mesh, and just the surface nodes
+    def distort():
+        buf = tr.workArray(coords.shape)
+        buf[:] = coords
+        tr.distortInPlace(buf,coords,res["u"],cached,sclfact)
+        return buf
+    timeStage(results,meta,"distort_full",distort,repeat)
+    timeStage(results,meta,"surface_extract",lambda: tr.buildSurface(mesh),1)
+    timeStage(results,meta,"surface_gather",
+              lambda: tr.surfaceArrays(cached,res["u"],sclfact,res["nodal"]),repeat)
+    points, tris, vvals = tr.surfaceArrays(cached,res["u"],sclfact,res["nodal"])
+    meta["surface_points"] = len(points)
+    meta["surface_tris"] = len(tris)
+    normals = timeStage(results,meta,"normals",lambda: tr.surfaceNormals(points,tris),repeat)
+    colors = timeStage(results,meta,"colors",lambda: tr.valuesToColors(vvals),repeat)
+
+# 3.2.4: Each output type in outtype_list. VTK goes through DPF in the translator, so here it is
+#        written by pyvista from the same grid as a stand in
+    base = os.path.join(outDir, "bench-" + kind + "-" + str(nnode))
+    writers = {
+        "vtk":  lambda f: grid.save(f, binary=True),
+        "obj":  lambda f: tr.writeObj(f,points,tris,normals,colors),
+        "stl":  lambda f: tr.writeStl(f,points,tris),
+        "stlb": lambda f: tr.writeStlBinary(f,points,tris),
+        "wrl":  lambda f: tr.writeWrl(f,points,tris,normals,colors),
+        "glb":  lambda f: tr.writeGlb(f,points,tris,normals,colors),
+    }
+    for ot in tr.outtype_list:
+        if ot not in writers:
+            continue
+        fname = tr.outputFiles(base,[ot],None)[ot][2]
+        timeStage(results,meta,"export_"+ot,lambda: writers[ot](fname),repeat)
+        results[-1]["bytes_out"] = os.path.getsize(fname)
+        os.remove(fname)
+
+# 3.3: The same stages on a real result file, if one was given. This needs DPF.
+#      The first get() is the solution load, the second one shows what a cache hit costs
+def benchRst(results,rstPath,rstnum,repeat,outDir):
+    tr.solCache.clear()
+    meta = {"mesh":os.path.basename(rstPath), "set":rstnum}
+    timeStage(results,meta,"dpf_server",tr.startDpf,1)
+    cached = timeStage(results,meta,"load",lambda: tr.solCache.get(rstPath),1)
+    timeStage(results,meta,"load_cached",lambda: tr.solCache.get(rstPath),repeat)
+    mesh = cached["mesh"]
+    meta["nodes"] = mesh.nodes.n_nodes
+    meta["elements"] = mesh.elements.n_elements
+    setres = tr.SetResults(cached["sol"],rstnum,cached["nsets"])
+    usumval = timeStage(results,meta,"read_displacement",setres.dispVector,1)
+    timeStage(results,meta,"read_stress",lambda: setres.fields("seqv"),1)
+    timeStage(results,meta,"max_deflection",lambda: tr.maxDeflection(usumval),repeat)
+    timeStage(results,meta,"grid",lambda: mesh.grid,1)
+    timeStage(results,meta,"surface_extract",lambda: tr.cachedSurface(cached),1)
+
+# 3.3.1: Whole translations for each output type. The output root has the folder in it,
+#        so the files go to the scratch folder and not next to the result file. 
+#        force is on so every repeat writes the file, not just the first one (the rest would 
+#        find the file up to date with its manifest and time nothing)
+    tr.tzEcho = False
+    tr.exportOptions["force"] = True
+    rstFile = os.path.basename(rstPath)
+    rstDir = os.path.dirname(rstPath)
+    outroot = os.path.join(outDir,"bench")
+    for ot in tr.outtype_list:
+        if ot == "none":
+            continue
+        timeStage(results,meta,"translate_"+ot,
+                  lambda: tr.createResultFile(rstnum,5.0,"seqv",rstFile,rstDir,ot,outroot,0),repeat)
+
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#
+#  ##### SECTION 4 #####
+#
+# The main program. Run the meshes, write the report, and compare to an old report if asked.
+#
+# 4.1: Sizes can be given as 10k, 2.5M and so on
+def parseSize(theStr):
+    theStr = theStr.strip().lower()
+    mult = 1
+    if theStr.endswith("k"):
+        mult, theStr = 1000, theStr[:-1]
+    elif theStr.endswith("m"):
+        mult, theStr = 1000000, theStr[:-1]
+    return int(float(theStr)*mult)
+
+# 4.2: Compare this run to an old report. Match stages by mesh, size and stage name, and flag
+#      anything that got slower by more than the threshold. Returns the number of slow downs
+def compareReports(newResults,oldPath,threshold):
+    with open(oldPath) as fh:
+        old = json.load(fh)
+    def key(r):
+        return (r.get("mesh"), r.get("target_nodes", r.get("set")), r["stage"])
+    oldTimes = {key(r):r["wall_s"] for r in old["results"]}
+    slower = 0
+    print("===========================================================================")
+    print("Compared to " + oldPath + " (" + old.get("created","") + ")")
+    for r in newResults:
+        k = key(r)
+        if k not in oldTimes or oldTimes[k] <= 0.0:
+            continue
+        ratio = r["wall_s"]/oldTimes[k]
+        flag = ""
+        if ratio > 1.0 + threshold:
+            flag = "  <-- SLOWER"
+            slower += 1
+        print("  %-10s %-10s %-22s %9.4f s -> %9.4f s  x%.2f%s" %
+              (k[0], k[1], k[2], oldTimes[k], r["wall_s"], ratio, flag))
+    print("  %d stage(s) slower by more than %.0f%%" % (slower, threshold*100))
+    return slower
+
+# 4.3: Read the arguments, run everything, and write the report
+def main(argv):
+    parser = argparse.ArgumentParser(description="Time the stages of the Ansys 3D result translator")
+    parser.add_argument("--sizes", default="10k,100k,1M",
+                        help="Node counts for the synthetic meshes (default 10k,100k,1M, up to 10M)")
+    parser.add_argument("--kinds", default="hex,tet", help="Mesh types: hex, tet, or both")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each stage, the fastest is kept")
+    parser.add_argument("--rst", default=None, help="Also time a real result file (needs DPF)")
+    parser.add_argument("--set", type=int, default=1, help="Result set to use with --rst")
+    parser.add_argument("--out", default="bench_output.json", help="Report file to write")
+    parser.add_argument("--compare", default=None, help="An old report to compare this run to")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="How much slower counts as a slow down when comparing (default 0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    results = []
+
+# 4.3.1: The translator loads DPF and pyvista the first time they are needed, and the synthetic 
+#        meshes use the DPF location names, so load them here and time it
+#        The files written along the way go to a scratch folder that is removed at the end
+    print("===========================================================================")
+    timeStage(results,{"mesh":"none"},"import",tr.loadAnsys,1)
+    with tempfile.TemporaryDirectory(prefix="ansys3d-bench-") as outDir:
+        for kind in [k.strip() for k in args.kinds.split(",")]:
+            for size in [parseSize(s) for s in args.sizes.split(",")]:
+                print("===========================================================================")
+                print("%s mesh, about %d nodes" % (kind, size), flush=True)
+                benchMesh(results,kind,size,args.repeat,outDir)
+        if args.rst is not None:
+            print("===========================================================================")
+            print("Result file " + args.rst + ", set " + str(args.set), flush=True)
+            benchRst(results,os.path.abspath(args.rst),args.set,args.repeat,outDir)
+
+# 4.3.2: The report has what it was run on, so two reports can be compared fairly
+    report = {
+        "created":time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python":platform.python_version(), "numpy":np.__version__, "pyvista":pv.__version__,
+        "platform":platform.platform(), "cpus":os.cpu_count(),
+        "args":vars(args), "results":results,
+    }
+    with open(args.out,"w") as fh:
+        json.dump(report, fh, indent=1)
+    print("===========================================================================")
+    print("Report written to " + args.out)
+
+    if args.compare is not None:
+        if compareReports(results,args.compare,args.threshold) > 0:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
+
+#------------------ End of program
@@ -2,25 +2,33 @@
 # Anssy_3D_Result_Translatro.py
 #
 #      Version 1.0: Initial Public release, 9/16/2023
+#      Version 1.3: Batch, watch, and service modes, binary STL and GLB, levels of detail, 
+#                   "all" results VTK, multi-set VTKHDF, and up to date checks with manifests
 #
 #      Purpose:  Uses PyAnsys to read Ansys Mechanical RST/RTH and Output distorted 3D Files 
-#                Supports WRL, OBJ, STL, VTK
+#                Supports WRL, OBJ, STL (ASCII and binary), GLB, VTK
 #
 #       Author: Eric Miller, PADT, Inc
 #               eric.miller@padtinc.com 
 #
 #       More info: Blog posts: https://www.padtinc.com/tag/3d-result-file-pyansys-tutorials/
 #
+#       Usage:  python Ansys_3D_Result_Translator.py         (opens the GUI)
+#               python Ansys_3D_Result_Translator.py -h      (help for the batch mode, Section 6)
+#               python Ansys_3D_Result_Translator.py watch -h   (help for watching folders, Section 19)
+#               python Ansys_3D_Result_Translator.py serve -h   (help for the translation service, Section 20)
+#
 ####################################################################################################
 #
 #### SECTION 1 ####
 
-#1.1: Get all modules loaded, starting with the Ansys realted ones
-from ansys.dpf import post
-from ansys.dpf import core as dpf
-from ansys.dpf.core import operators as coreops
-from ansys.dpf.core import fields_container_factory
-from ansys.dpf.core.plotter import DpfPlotter
+#1.1: The Ansys realted modules (and pyvista, 1.3) take seconds to import, and the window 
+#       or the batch mode should come up right away. So they are not loaded here. 
+#       loadAnsys() (Section 16) loads them the first time they are needed and puts them in 
+#       these globals, and startDpf() starts the one DPF server that every translation uses
+post = None
+dpf = None
+coreops = None
 
 #1.2: For our GUI, we will us TKInter
 #     So load what we are going to use for TKInter
@@ -35,9 +43,71 @@ from tkinter import scrolledtext
 #1.3: Now we need pyvista, numpy and os to output in some formats
 #       pyansys doesn't support, play with the data, and interact with 
 # #     the operating system.  
-import pyvista as pv
+#       pyvista is loaded with the Ansys modules by loadAnsys()
+pv = None
 import numpy as np
 import os
+import json
+import tempfile
+import hashlib
+
+#1.4: For the batch (no GUI) mode we need a command line parser, a timer,
+#       and a pool of processes to spread the translations over. 
+#       A pool of threads writes the files when more than one format is asked for (Section 5)
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+#1.4.1: The translation service (Section 20) is a small web server built on asyncio
+import asyncio
+import urllib.parse
+
+#1.5: The solution cache (Section 7) is an ordered dictionary with a lock around it, 
+#       and the GUI runs translations on a background thread fed by a queue (Section 9)
+import threading
+import queue
+import multiprocessing.util
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+#1.6: The result types and output file types we support. These are used by
+#       the dropdowns in the GUI and to check the values given in batch mode
+#       "all" puts every displacement, stress, and temperature result in one VTK file (Section 8)
+rsttype_list = ('u','ux','uy','uz','usum','sx','sy','sz','s1','s2','s3','seqv','tmp','all')
+outtype_list = ('vtk','obj','stl','stlb','wrl','glb','none')
+
+#1.7: Options for how the files get written. The batch mode sets these from the command line 
+#       and the GUI from its widgets
+#       quantize: pack the GLB positions into 16 bit integers and the normals into 8 bit (Section 13)
+#       memCapMB: keep the work arrays and blocks under this many MB, None for no cap (Section 14)
+#       scratchDir: where big work arrays go when there is a memory cap, None for the temp folder
+#       metricsLog: a file to add the stage timings to as lines of JSON, None for no log (Section 15)
+#       scaleMode: "set" scales the deflection of each set on its own, "global" uses the biggest 
+#                  deflection of all the sets in scaleSets (None for every set on the file) (Section 8)
+#       fixedUmax: a biggest deflection that was already worked out, so the batch mode can find it 
+#                  once up front and hand it to every worker. None to work it out
+#       dpfServer: "host:port" of a DPF server that is already running, None to start our own (Section 16)
+#       lod: levels of detail for the surface files, like ["full","50000","0.5%"], None for just 
+#            the full surface (Section 17)
+#       force: write every file, even the ones whose manifest says they are up to date (Section 18)
+#       colormap: the colors for the result values in OBJ, WRL, and GLB, a name from colorMaps (Section 11)
+#       colorRange: (min,max) of the colors, None for the min and max of the values
+#       averageBodies: average elemental results to the nodes within each body, not across 
+#                      the boundaries between bodies (Section 21)
+exportOptions = {"quantize":False, "memCapMB":None, "scratchDir":None, "metricsLog":None,
+                 "scaleMode":"set", "scaleSets":None, "fixedUmax":None, "dpfServer":None, "lod":None,
+                 "force":False, "colormap":"rainbow", "colorRange":None, "averageBodies":False}
+
+#1.8: The version of this program. It goes in the manifest next to each file (Section 18), 
+#       so change it when a change here makes the files come out different
+toolVersion = "1.3"
+
+#1.9: When we run without the GUI there is no text zone to print to, 
+#       so tzPrint() sends messages to the console instead. 
+#       tzEcho lets the batch workers turn those messages off
+textZone = None
+tzEcho = True
 
 # Jump down to the main program for section 2!
 #  This program is now big enough to have fundtions.
@@ -55,10 +125,11 @@ import os
 #       Takes the variable that is being entered, a text label, and what row it goes into
 #       The widget is put on the specified row, the label is in column 2 and the input in column 3
 #       The label is right justfied (E) and the input is left justified (W)
-def bldInput(theVar,theLbl,theRow):
-    ttk.Label(frm1, text=theLbl).grid(column=2, row=theRow, sticky=E)
+#       The options on the right side of the window give theCol=4 to use columns 4 and 5 instead
+def bldInput(theVar,theLbl,theRow,theCol=2):
+    ttk.Label(frm1, text=theLbl).grid(column=theCol, row=theRow, sticky=E)
     theEntry = ttk.Entry(frm1,  textvariable=theVar, justify=CENTER)
-    theEntry.grid(column=3, row=theRow,  sticky=W)
+    theEntry.grid(column=theCol+1, row=theRow,  sticky=W)
 
 # 3.2: Make a dropdown input widget
 #      This also uses frm1 and takes the variable, a lable, and row number as inpu
@@ -72,17 +143,29 @@ def bldDrop(theVar,theLbl,theList,theRow):
     theDrop.grid(column=3, row=theRow, sticky=W)
 
 #3.3: To give input to the users, we want to print to the text zone called tz.
-#     This requires unlocking the zone, adding the text, scrolling to the bottom, locking the zone, then updating the window
+#     This requires unlocking the zone, adding the text, scrolling to the bottom, and locking the zone
+#     If there is no text zone (batch mode), just print the line to the console
+#     TK widgets can only be touched from the main thread, so if a background translation 
+#     (Section 9) is printing, the line goes on the message queue and pollMessages() prints it
 def tzPrint(tz,val):
+    if tz is None:
+        if tzEcho:
+            print(val, flush=True)
+        return
+    if threading.current_thread() is not threading.main_thread():
+        msgQueue.put(("line",val))
+        return
     tz.configure(state ='normal')
     tz.insert(tk.INSERT,val+"\n")
     tz.see(tk.END)
     tz.configure(state ='disabled')
-    myDialog.update()
 
 #3.4: This is a simple function that we use to close down the window when the user presses the "close" button
+#     Stop any translation that is running so the worker thread does not keep going
 def closeIt():
+    cancelJobs()
     myDialog.destroy()
+    stopDpf()
 
 #3.5: This is the function that gets called when they click on "choose result file" It is a standard dialog
 #     It uses the TKInter filedialog to let he user specify the result file
@@ -123,6 +206,11 @@ def select_file():
 def doTranslate(*args):
     missingVals = []
 
+### The export options from the window go in their own dictionary that is queued with the job. 
+###   A job may be running on the worker thread right now and using exportOptions, so only the 
+###   worker thread changes those (Section 9)
+    opts = {}
+
 ### reselt set number is an int, so try and pull it and use except if it is missing
     try:
         rn = int(rstNum.get())
@@ -153,6 +241,27 @@ def doTranslate(*args):
     ot = outtype.get()
     if len(ot) == 0:
         missingVals.append("Output File Type")
+    elif rt == "all" and ot not in ("vtk","none"):
+        missingVals.append("Output File Type (the all result type needs vtk)")
+
+### The extra output types are optional, but each one has to be on the list
+    try:
+        also = parseNameList(alsoOut.get(),outtype_list,"output file type")
+        if rt == "all" and any(at not in ("vtk","none") for at in also):
+            missingVals.append("Also Write Types (the all result type needs vtk)")
+        if len(ot) > 0 and len(also) > 0:
+            ot = ",".join([ot] + also)
+    except argparse.ArgumentTypeError as exc:
+        missingVals.append("Also Write Types: " + str(exc))
+
+### The levels of detail are optional too, blank means just the full surface
+    try:
+        lvls = parseLodList(lodLvls.get())
+        if len(lvls) == 0:
+            lvls = None
+        opts["lod"] = lvls
+    except argparse.ArgumentTypeError as exc:
+        missingVals.append("LOD Levels: " + str(exc))
 
 ### Another string, check length
     or1 = outroot.get()
@@ -161,14 +270,32 @@ def doTranslate(*args):
 
 # nothign to check for the plot checkbox, so just pull the value
     dp = doPlot.get()
+    opts["quantize"] = bool(doQuant.get())
+    opts["force"] = bool(doForce.get())
+    if doGlobal.get():
+        opts["scaleMode"] = "global"
+    else:
+        opts["scaleMode"] = "set"
+
+### The memory cap is optional, so blank means no cap. Anything else has to be a number
+    mc = memCap.get().strip()
+    if len(mc) == 0:
+        opts["memCapMB"] = None
+    else:
+        try:
+            opts["memCapMB"] = float(mc)
+        except:
+            missingVals.append("Memory Cap (MB)")
 ##
 # 4.2: We have checked everything, now see if anything was missing.
 #      Do this by looking at the lenght of the missing list,
-#      If the length is zero, all is good and pass the extracted values to createResultFile()
+#      If the length is zero, all is good and put the extracted values and options on the job queue. 
+#      The worker thread (Section 9) passes them to createResultFile() when it gets to them, 
+#      so the user can queue up more files while one is running
 #      If there was a problem, use the TKInter showerror() tool to list all the missing values in a message
 #      and return to the window
     if len(missingVals) == 0:
-        createResultFile(rn,pd,rt,rf,rd,ot,or1,dp)
+        queueJob((rn,pd,rt,rf,rd,ot,or1,dp),opts)
     else:
         showerror(title="Missing Input, please specify a value for each input!", message = "\n".join(missingVals))
 #
@@ -182,12 +309,28 @@ def doTranslate(*args):
 #    get results, calcs distortion, displays a plot, and makes the requested 3D output file. 
 #    This is bascially the script from the part 2 tutorial with some additions
 #
-def createResultFile(rstnum,pcntdfl,rsttype,rstFile,rstDir,outtype,outroot,doPlot):
+def createResultFile(rstnum,pcntdfl,rsttype,rstFile,rstDir,outtype,outroot,doPlot,metrics=None):
+    global lastMetrics
  
 # 5.1: Build the output file name from the file root and 
 #      the result type and file type
+#      Everything gets written next to the result file
+#      outtype can be more than one file type, as a list or a comma separated string like "vtk,stl", 
+#      so there is a file name for each one. "none" makes no file
+    if isinstance(outtype,str):
+        outtype = outtype.split(",")
+    outtypes = []
+    for ot in outtype:
+        if ot.strip() not in outtypes:
+            outtypes.append(ot.strip())
+    outtype = ",".join(outtypes)
     outfname = outroot + "-" + rsttype + "-" + str(rstnum)
-    fullOutFname = rstDir+outfname+"."+outtype
+
+# 5.1.1: The surface types can also be written at lighter levels of detail (Section 17), given in 
+#        exportOptions["lod"]. Each level gets "-lod1", "-lod2", ... on the name, and "full" is 
+#        the normal file. outFiles has the type, level (None for full), and file name of each file.
+#        The names come from outputFiles() (Section 20) so the translation service knows them too
+    outFiles = outputFiles(os.path.join(rstDir,outfname),outtypes,exportOptions["lod"])
 
  # 5.2: Set a boolean on blotting. We want "true or false" for the message to the user
     if doPlot ==1:
@@ -202,135 +345,166 @@ def createResultFile(rstnum,pcntdfl,rsttype,rstFile,rstDir,outtype,outroot,doPlo
     tzPrint (textZone,"  Solution Step/mode: "+str(rstnum))
     tzPrint (textZone,"  Result type: "+rsttype)
     tzPrint (textZone,"  Percent deflection distortion: "+str(pcntdfl))
-    tzPrint (textZone,"  Output file: "+outfname+"."+outtype)
+    tzPrint (textZone,"  Output file: "+(", ".join(os.path.basename(f) for ot, level, f in outFiles.values()) or "none"))
+    if exportOptions["lod"] is not None:
+        tzPrint (textZone,"  Levels of detail: "+", ".join(exportOptions["lod"]))
     tzPrint (textZone,"  Plot before making file: "+str(doplot))
     tzPrint (textZone,"---------------------------------------------------------------------------")
 
-#5.5: Open the result file and load the solution and mesh
-    path1 = os.getcwd()
-    os.chdir(rstDir)
-    path = os.getcwd()
-    mysol = post.load_solution(rstFile)
-    mymesh = mysol.mesh
-
-#5.6: Grab the results from the specified solution step, 
-#     then get the request result type (thermal or displacement and stress)
+# 5.4.1: Each step below is timed as a stage of a StageMetrics object (Section 15). 
+#        The batch mode hands us one so it can put the timings in its summary
+    if metrics is None:
+        metrics = StageMetrics({"rstFile":rstFile, "rstnum":rstnum, "rsttype":rsttype, "outtype":outtype})
+    lastMetrics = metrics
+
+# 5.4.2: Each file has a manifest next to it with a hash of everything that went into it (Section 18). 
+#        If the hash is the same and the file is still there, it is up to date and we leave it out, 
+#        unless exportOptions["force"] is set. If every file is up to date, we are done
+    digests = OrderedDict()
+    with metrics.stage("manifest") as stg:
+        skipped = 0
+        for label in list(outFiles):
+            ot, level, fname = outFiles[label]
+            digests[label] = outputHash(os.path.join(rstDir,rstFile),rstnum,pcntdfl,rsttype,ot,level)
+            if not exportOptions["force"] and upToDate(fname,digests[label][0]):
+                tzPrint (textZone,"  Up to date, not written again: " + os.path.basename(fname))
+                del outFiles[label]
+                skipped += 1
+        stg["skipped"] = skipped
+        stg["stale"] = len(outFiles)
+
+# 5.4.3: Everything below is only done for the files that are left, so an up to date VTK or OBJ 
+#        file does not make us copy the mesh or work out the colored surface again
+    staleTypes = [ot for ot, level, fname in outFiles.values()]
+    if skipped > 0 and len(outFiles) == 0 and not doplot:
+        tzPrint (textZone,"---------------------------------------------------------------------------")
+        tzPrint (textZone,"All " + str(skipped) + " file(s) are up to date, nothing to do")
+        tzPrint (textZone, " ")
+        return TRUE
 
+#5.5: Open the result file and load the solution and mesh
+#     These come from the solution cache (Section 7), so if we already opened this 
+#     file and it has not changed, we skip the load and the mesh read
+    tzProgress(5)
+    with metrics.stage("load") as stg:
+        cached = solCache.get(os.path.join(rstDir,rstFile))
+        mysol = cached["sol"]
+        mymesh = cached["mesh"]
+        stg["cacheHit"] = cached["hit"]
+        metrics.addArray("mesh",cached["nbytes"])
+    checkCancel()
+    tzProgress(25)
+
+#5.6: Grab the results from the specified solution step. 
+#     SetResults (Section 8) only reads things from the file when we ask for them, 
+#     so a displacement file never reads stresses, and the stress results all come from one 
+#     read of the stress tensor. STL files have no result values, so unless we are plotting 
+#     we don't need to read the requested result at all, just the displacements to distort the mesh
+#     The same goes for binary STL (stlb)
+#     The "all" result type reads the displacements, stress tensor, and temperatures once and works out 
+#     every result from them (Section 8). Only a VTK file can hold more than one result
+
+    if rsttype == "all" and any(ot not in ("vtk","none") for ot in outtypes):
+        raise ValueError("The all result type can only be written to a vtk file")
     tzPrint (textZone,"++ Getting result information from file")
+    setres = SetResults(mysol,rstnum,cached["nsets"])
+    needResult = doplot or any(ot in ("vtk","obj","wrl","glb") for ot in staleTypes)
+    usumval = None
 
-# displacement, stress, and thermal for the solution set number
-    if rsttype == "tmp":
-        thrm1 = mysol.temperature(set=rstnum)
-    else:
-        dsp1 = mysol.displacement(set=rstnum)
-        str1 = mysol.stress(set=rstnum)
-
-#5.7: Use an if statement to pull in the specific result values
+#5.7: Pull in the displacements for the distortion and the specific result values
 #     Add in a try/except to catch when they put in a result type or number that is not in the file
-# Start with displacement
-    try: 
-        if rsttype == "u":
-            rstval = dsp1.vector.result_fields_container
-        elif rsttype == "ux":
-            rstval = dsp1.x.result_fields_container
-        elif rsttype == "uy":
-            rstval = dsp1.y.result_fields_container
-        elif rsttype == "uz":
-            rstval = dsp1.z.result_fields_container
-        elif rsttype == "usum":
-            rstval = dsp1.norm.result_fields_container
-
-    # Now check for stresses
-        elif rsttype == "seqv":
-            rstval = str1.von_mises.result_fields_container
-        elif rsttype == "s1":
-            rstval = str1.principal_1.result_fields_container
-        elif rsttype == "s2":
-            rstval = str1.principal_2.result_fields_container
-        elif rsttype == "s3":
-            rstval = str1.principal_3.result_fields_container
-        elif rsttype == "sx":
-            rstval = str1.xx.result_fields_container
-        elif rsttype == "sy":
-            rstval = str1.yy.result_fields_container
-        elif rsttype == "sz":
-            rstval = str1.zz.result_fields_container
-        elif rsttype == "xy":
-            rstval = str1.xy.result_fields_container
-        elif rsttype == "xz":
-            rstval = str1.xz.result_fields_container
-        elif rsttype == "yz":
-            rstval = str1.yz.result_fields_container
-
-# Last, do temperatures
-        elif rsttype == "tmp":
-            rstval = thrm1.scalar.result_fields_container
-    except:
-        tzPrint (textZone,"###################################################################")
-        tzPrint (textZone,"    ERROR")
-        tzPrint (textZone,"Could not find the result you are looking for on the result file")
-        tzPrint (textZone,"   Change the requested result type, number, or the file")
-        tzPrint (textZone,"###################################################################")
-        return FALSE
-# 5.8: If this is thermal, just copy the 
-#      undistored mesh to the variables we will us to plot and write 
-    if rsttype == "tmp": 
-        dflmesh = mymesh.deep_copy()
-        newcoord = dflmesh.nodes.coordinates_field
-    else:
+    with metrics.stage("extract") as stg:
+        try: 
+            setres.checkSet()
+            if rsttype == "all":
+                allvals = setres.allResults(cached)
+                if len(setres.omitted) > 0:
+                    tzPrint (textZone,"  Not on this file, left out of the all file: " + ", ".join(setres.omitted))
+                if "usum" in allvals:
+                    usumval = setres.dispVector()
+                for name in allvals:
+                    metrics.addArray(name,allvals[name][0])
+            elif rsttype != "tmp":
+                usumval = setres.dispVector()
+                metrics.addFields("disp",usumval)
+            if needResult and rsttype != "all":
+                rstval = setres.fields(rsttype)
+                metrics.addFields(rsttype,rstval)
+        except:
+            stg["ok"] = False
+            tzPrint (textZone,"###################################################################")
+            tzPrint (textZone,"    ERROR")
+            tzPrint (textZone,"Could not find the result you are looking for on the result file")
+            tzPrint (textZone,"   Change the requested result type, number, or the file")
+            tzPrint (textZone,"###################################################################")
+            return FALSE
+    checkCancel()
+    tzProgress(50)
+
+# 5.8: If this is thermal, the mesh does not get distorted, so there is no scale factor
+#      The same goes for "all" on a thermal file, which has no displacements
+#      The scale factor and the distorted mesh are timed together as the "distort" stage
+    with metrics.stage("distort"):
+        if rsttype == "tmp" or usumval is None: 
+            usumval = None
+            sclfact = 0.0
+        else:
 #5.9: Not thermal so get info needed to calculate a distorted mesh
-        tzPrint (textZone,"++ Calculating deflection distortion")
+            tzPrint (textZone,"++ Calculating deflection distortion")
 # Calcluate the distortion amounts
 
-# Grab the total distortion at each node
-
-        usumval = dsp1.vector.result_fields_container
+# The total distortion at each node (usumval) was read in 5.7
         
-# Get model extents. Feed the min_max operator "mymesh"
-        extop = dpf.operators.min_max.min_max(mymesh.nodes.coordinates_field)
-        coordmin = extop.outputs.field_min()
-        coordmax = extop.outputs.field_max()
-
-# Look at the X, Y, Z min and max coordinate 
-#   value and find the biggest demention of the mesh
-#   There is probably a clever python way to do this in one line
-        dltmax =0.0
-        for i in range(0,3):
-            if (coordmax.data[i]-coordmin.data[i]) > dltmax:
-                dltmax = coordmax.data[i]-coordmin.data[i]
-
-# Get the maximum deflection value from usumval
-        umaxop = dpf.operators.min_max.min_max(field=usumval)
-        umax = 0.0
-        for i in range(0,3):
-            if (umaxop.outputs.field_max().data[i]) > umax:
-                umax = umaxop.outputs.field_max().data[i]
-
-# Calculate a scale factor that is the specified 
-#   percentage of the max deflection devided by the max size
-        dflsf = pcntdfl/100.0
-        sclfact = dflsf*dltmax/umax
+# Get a scale factor that is the specified percentage of the max size divided by the max deflection
+#   The model extents only depend on the mesh so they were calculated when the solution was 
+#   loaded into the cache. The max deflection is from this set, or from all of the sets if the 
+#   scale mode is "global", and it is kept in the cache too (Section 8)
+            sclfact = scaleFactor(cached,pcntdfl,rstnum,usumval)
+            tzPrint (textZone,"   Scale factor (" + exportOptions["scaleMode"] + "): %g" % sclfact)
 
 #5.10: Scale the deflection values then distort the nodal coordinates
+#      Only the VTK file and the plot need a whole distorted copy of the mesh. STL, OBJ, and WRL
+#      use the outside surface from the cache (Section 12) and only move the nodes on it
+        needMesh = doplot or ("vtk" in staleTypes and rsttype != "all")
+        if needMesh:
 
 # Get a copy of the mesh to distort
-        dflmesh = mymesh.deep_copy()
-        newcoord = dflmesh.nodes.coordinates_field
-
-# Scale the deflection field by the scale factor
-        sclop = dpf.operators.math.scale(usumval,float(sclfact))
-        scaledusum = sclop.outputs.field()
-
-
-# Add the scaled deflection field to the nodal positions
-        addop = dpf.operators.math.add(newcoord, scaledusum)
-        tempcoord = addop.outputs.field()
+            dflmesh = mymesh.deep_copy()
+            newcoord = dflmesh.nodes.coordinates_field
+
+            if usumval is not None:
+# Start with a copy of the nodal positions, then add the scaled displacements of every 
+#   body to it in place, a block of nodes at a time (Section 14)
+                coords = cachedCoords(cached)
+                tempcoord = workArray(coords.shape)
+                tempcoord[:] = coords
+                distortInPlace(tempcoord,coords,usumval,cached,sclfact)
+                metrics.addArray("coords",tempcoord)
 
 # Overwrite the nodal positions of dflmesh with the deflected ones
-        newcoord.data = tempcoord.data
+                newcoord.data = tempcoord
+                del tempcoord
+
+# The "all" VTK file is written from the distorted coordinates with pyvista (5.12.1), 
+#   so it does not need a copy of the DPF mesh, just the coordinates
+        if rsttype == "all" and "vtk" in staleTypes:
+            coords = cachedCoords(cached)
+            allcoord = workArray(coords.shape)
+            allcoord[:] = coords
+            if usumval is not None:
+                distortInPlace(allcoord,coords,usumval,cached,sclfact)
+            metrics.addArray("coords",allcoord)
+
+    checkCancel()
+    tzProgress(70)
 
 # 5.11: No addition from the part 2 vesrion, we check the doplot flag to see if the user wants a plot or not
 #       if they do, let them know, make a DPFPlotter object, then build the plot up
+#       Every body in the result goes on the plot, so gather them all into one array first
+#       The plot window has to be opened by the main thread, so showPlot() hands it over if we are 
+#       running in the background
+#       In the GUI the "plot" stage is only the time to get the values ready and hand them over, 
+#       since the window stays open on the main thread after the job goes on
     if doplot:
         tzPrint (textZone,"++ Making plot")
         tzPrint (textZone,"   ")
@@ -340,101 +514,2877 @@ def createResultFile(rstnum,pcntdfl,rsttype,rstFile,rstDir,outtype,outroot,doPlo
         tzPrint (textZone,"     W = Wire Frame | S = Shaded Solid")
         tzPrint (textZone,"     E or Q = Exit Window")
 
-        plt = DpfPlotter()
-        plt.add_field(rstval[0],dflmesh,show_edges=False) 
+        with metrics.stage("plot"):
+            if rsttype == "all":
+                pltname = [nm for nm in ("seqv","usum","tmp") if nm in allvals][0]
+                pltvals, pltloc = allvals[pltname]
+            else:
+                pltname = rsttype
+                pltvals, pltloc = gatherField(rstval,cached)
+            metrics.addArray("values",pltvals)
+            showPlot(pltvals,pltloc,dflmesh,pltname)
 
-#display the plot      
-        plt.show_figure(
-            show_axes=True,
-            parallel_projection=False,
-            background="#aaaaaa"
-        )
 # 5.12:  This is where we create the various formats. For this version we will add OBJ and STL as options. 
+#        More than one format can be asked for at once. Everything they need is worked out once 
+#        here, then the writers all run at the same time on a pool of threads (5.12.6). They only 
+#        read the arrays, so they can share them
+#        The whole thing is timed as the "export" stage, with the time and size of each file
+
+    tzPrint (textZone,"++ Making output file" + ("s" if len(outFiles) > 1 else ""))
+    tzProgress(80)
+
+    with metrics.stage("export") as stg:
+
+# 5.12.1: OBJ, WRL, and GLB need the surface with a color at each point, STL and STLB just the 
+#         surface. If any of the first three are asked for, the STL files use the same surface
+        vvals = None
+        if any(ot in ("obj","wrl","glb") for ot in staleTypes):
+            points, tris, vvals = surfaceArrays(cached,usumval,sclfact,rstval)
+            metrics.addArrays(points=points,tris=tris,values=vvals)
+        elif any(ot in ("stl","stlb") for ot in staleTypes):
+            points, tris = surfacePoints(cached,usumval,sclfact)
+            metrics.addArrays(points=points,tris=tris)
+
+# 5.12.1.1: Then the surface for each level of detail, with the normals and colors if they are 
+#           needed. Every level is colored over the range of the full surface, so they all match, 
+#           unless exportOptions["colorRange"] gives the range
+        surfaces = OrderedDict()
+        for ot, level, fname in outFiles.values():
+            if ot == "vtk" or level in surfaces:
+                continue
+            if level is None:
+                lpoints, ltris, lvals = points, tris, vvals
+            else:
+                lpoints, ltris, lvals = lodSurface(cached,level,points,vvals)
+                metrics.addArrays(**{"points-"+level:lpoints, "tris-"+level:ltris})
+            surfaces[level] = {"points":lpoints, "tris":ltris}
+            if lvals is not None:
+                good = np.isfinite(vvals)
+                vmin = np.min(vvals[good]) if np.any(good) else None
+                vmax = np.max(vvals[good]) if np.any(good) else None
+                if exportOptions["colorRange"] is not None:
+                    vmin, vmax = exportOptions["colorRange"]
+                surfaces[level]["normals"] = surfaceNormals(lpoints,ltris)
+                surfaces[level]["colors"] = valuesToColors(lvals,vmin,vmax,exportOptions["colormap"])
+            stg["tris-" + str(level or "full")] = len(ltris)
+
+        def writeOne(label):
+            ot, level, fname = outFiles[label]
+            if ot != "vtk":
+                points = surfaces[level]["points"]
+                tris = surfaces[level]["tris"]
+                normals = surfaces[level].get("normals")
+                colors = surfaces[level].get("colors")
+            start = time.perf_counter()
+
+# 5.12.2: No change from previous version for the VTK format
+#         The "all" file has a point or cell array for every result, so it is written by 
+#         writeVtkArrays() (Section 11) instead of the DPF vtk_export operator
+            if ot == "vtk" and rsttype == "all":
+                writeVtkArrays(fname,mymesh.grid,allcoord,allvals)
+
+            elif ot == "vtk":
+                vtkop = coreops.serialization.vtk_export() 
+                vtkop.inputs.mesh.connect(dflmesh)
+
+                vtkop.inputs.file_path.connect(fname)
+                vtkop.inputs.fields1.connect(rstval)
+
+                vv = vtkop.run()
+
+# 5.12.3: STL is just the distorted outside surface as triangles, so we write it from the 
+#         cached surface (Section 12) with our own writer (Section 11)
+#         NOTE: STL does not support colors, so this is just a distorted faced file. 
+#         Binary STL (stlb) is the same triangles, but much smaller and faster to write (Section 13)
+            elif ot == "stl":
+                writeStl(fname,points,tris)
+            elif ot == "stlb":
+                writeStlBinary(fname,points,tris)
+
+#5.12.4: OBJ and WRL only need the outside skin of the model. 
+#     The outside surface of the mesh comes from the cache (Section 12), so for each file we 
+#     only distort the nodes on the surface and pick up their result values. 
+#     It also doesn't automatically handle element values vs nodal value, 
+#     so we have to handle that and turn the values into a color at every vertex
+#     The writers in Section 11 write the arrays straight to the file, no plot window needed
+            elif ot == "obj":
+                writeObj(fname,points,tris,normals,colors)
+            elif ot == "wrl":
+                writeWrl(fname,points,tris,normals,colors)
+
+#5.12.5: GLB is the binary form of glTF, used by web viewers. It is the same surface, normals 
+#        and colors as OBJ, packed into binary buffers by writeGlb() (Section 13)
+            elif ot == "glb":
+                writeGlb(fname,points,tris,normals,colors,exportOptions["quantize"])
+
+            return time.perf_counter() - start
+
+# 5.12.6: Run the writers. One that fails does not stop the others, 
+#         we collect what went wrong and report it with the rest in 5.14
+        stg["files"] = OrderedDict()
+        failed = OrderedDict()
+        with ThreadPoolExecutor(max_workers=max(1,len(outFiles))) as pool:
+            futures = dict((pool.submit(writeOne,label), label) for label in outFiles)
+            for fut in as_completed(futures):
+                label = futures[fut]
+                try:
+                    secs = fut.result()
+                    stg["files"][label] = {"secs":secs, "bytes":os.path.getsize(outFiles[label][2])}
+                    writeManifest(outFiles[label][2],digests[label][0],digests[label][1])
+                except Exception as exc:
+                    failed[label] = type(exc).__name__ + ": " + str(exc)
+        stg["bytesOut"] = sum(f["bytes"] for f in stg["files"].values())
+        if len(failed) > 0:
+            stg["ok"] = False
 
-    tzPrint (textZone,"++ Making output file")
-
-# 5.12.1: No change from previous version for the VTK format
-    if outtype == "vtk":
-        vtkop = coreops.serialization.vtk_export() 
-        vtkop.inputs.mesh.connect(dflmesh)
+ 
+# 5.13: Since this is now a GUI, the user can modify the inputs and make more files, so we need to remove
+#       objects so we can make them new again. The solution and mesh stay in the cache for the next file
+    del mysol, mymesh
+    if needMesh:
+        del newcoord, dflmesh
+    if rsttype == "all":
+        del allvals
+    if "vtk" in outFiles and rsttype == "all":
+        del allcoord
 
-        vtkop.inputs.file_path.connect(outfname+".vtk")
-        vtkop.inputs.fields1.connect(rstval)
+# 5.14: All done. Let the user know they can keep going or exit. 
+    tzProgress(100)
+    tzPrint (textZone,"---------------------------------------------------------------------------")
+    for label in outFiles:
+        if label in failed:
+            tzPrint (textZone,"FAILED: " + outFiles[label][2] + " (" + failed[label] + ")")
+        else:
+            tzPrint (textZone,"File Created: %s (%.2f s, %.1f MB)" % (outFiles[label][2], 
+                     stg["files"][label]["secs"], stg["files"][label]["bytes"]/1024/1024))
+    tzPrint (textZone,"Solution cache: " + solCache.summary())
+    tzPrint (textZone,"Time and memory by stage:")
+    for line in metrics.summaryLines():
+        tzPrint (textZone,line)
+    tzPrint (textZone, " ")
+    if len(failed) > 0:
+        raise RuntimeError(str(len(failed)) + " of " + str(len(outFiles)) + " files failed: " + 
+                           "; ".join(label + ": " + failed[label] for label in failed))
+    tzPrint (textZone, "Please change the input values to create a new file or if you are finished, click Close")
+    return TRUE
+#
+# End of createResultFile()
 
-        vv = vtkop.run()
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#
+#  ##### SECTION 6 #####
+#
+#  Batch mode. When we have hundreds of load steps or modes to post process, clicking Translate 
+#    over and over is not practical. So if the program is run with arguments, we skip the GUI, 
+#    build a list of every (set, result type, output type) combination asked for, and hand 
+#    them out to a pool of worker processes. Each worker just calls createResultFile().
+#
+#    Example: 
+#       python Ansys_3D_Result_Translator.py file.rst --sets 1-20,25 --types u,seqv --formats vtk,stl
+#
+#    With --animate, each result type makes one animation file with every set in it (Section 10)
+#       python Ansys_3D_Result_Translator.py file.rst --sets 1-50 --types usum --animate
+#
+# 6.1: Turn a string like "1,3,5-10" into a list of set numbers. 
+#      A range can also have a step: "2-20:2" gives every other set
+def parseSetList(theStr):
+    sets = []
+    for item in theStr.split(","):
+        item = item.strip()
+        if len(item) == 0:
+            continue
+        step = 1
+        if ":" in item:
+            item, stp = item.split(":")
+            step = int(stp)
+        if "-" in item:
+            first, last = item.split("-")
+            sets.extend(range(int(first), int(last)+1, step))
+        else:
+            sets.append(int(item))
+    return sets
+
+# 6.2: Turn a comma separated string into a list and make sure every entry is in 
+#      the list of allowed values (rsttype_list or outtype_list) 
+def parseNameList(theStr,theList,theLbl):
+    names = [nm.strip() for nm in theStr.split(",") if len(nm.strip()) > 0]
+    bad = [nm for nm in names if nm not in theList]
+    if len(bad) > 0:
+        raise argparse.ArgumentTypeError(
+            "Unknown " + theLbl + ": " + ", ".join(bad) + " (choose from " + ", ".join(theList) + ")"
+        )
+    return names
+
+# 6.3: Each worker process runs this once when it starts. 
+#      Unless the user asks for it, we don't want every worker printing every line. 
+#      Each worker has its own solution cache, so set its memory budget here too, 
+#      and pass over the export options. 
+#      Pool workers leave with os._exit(), so atexit never runs in them. A multiprocessing 
+#      finalizer does, so that is how the worker's own DPF server gets shut down (Section 16)
+def initBatchWorker(verbose,cacheMB,options):
+    global tzEcho
+    tzEcho = verbose
+    solCache.setBudget(cacheMB)
+    exportOptions.update(options)
+    multiprocessing.util.Finalize(None, stopDpf, exitpriority=10)
+
+# 6.4: This is what each worker does for one job. It calls createResultFile() and times it. 
+#      Animation jobs have a list of sets and call createAnimationFile() instead
+#      Anything that goes wrong is caught and sent back so one bad set does not stop the batch
+#      The stage timings (Section 15) go back with the job for the summary
+def runBatchJob(job):
+    start = time.perf_counter()
+    hits = solCache.hits
+    metrics = StageMetrics({k:job[k] for k in ("rstFile","rstnum","rsttype","outtype")})
+    try:
+        if "rstsets" in job:
+            ok = createAnimationFile(job["rstsets"],job["pcntdfl"],job["rsttype"],job["rstFile"],
+                                     job["rstDir"],job["outroot"])
+        else:
+            ok = createResultFile(job["rstnum"],job["pcntdfl"],job["rsttype"],job["rstFile"],
+                                  job["rstDir"],job["outtype"],job["outroot"],0,metrics)
+        if ok:
+            err = ""
+        else:
+            err = "Result not found on the result file"
+    except Exception as exc:
+        ok = False
+        err = type(exc).__name__ + ": " + str(exc)
+    job = dict(job)
+    job["ok"] = bool(ok)
+    job["error"] = err
+    job["secs"] = time.perf_counter() - start
+    job["cacheHit"] = solCache.hits > hits
+    job["stages"] = metrics.records
+    job["dpfStart"] = (os.getpid(), dpfState["importSecs"], dpfState["serverSecs"])
+    return job
+
+# 6.5: The batch main program. Read the arguments, build the job list, run the jobs
+#      on the process pool, then print a summary with the timings and any failures. 
+#      Returns the exit code: 0 if everything worked, 1 if any job failed
+def runBatch(argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(sys.argv[0]),
+        description="Translate Ansys RST/RTH results to distorted 3D files without the GUI"
+    )
+    parser.add_argument("rstfile", help="Ansys result file (.rst or .rth)")
+    parser.add_argument("--sets", required=True, type=parseSetList,
+                        help="Result set numbers, for example 1,3,5-10 or 2-20:2")
+    parser.add_argument("--types", required=True, 
+                        type=lambda s: parseNameList(s,rsttype_list,"result type"),
+                        help="Result types: " + ",".join(rsttype_list))
+    parser.add_argument("--formats", 
+                        type=lambda s: parseNameList(s,outtype_list,"output file type"),
+                        help="Output file types, all written from one read of each set: " + ",".join(outtype_list))
+    parser.add_argument("--quantize", action="store_true",
+                        help="Write GLB files with 16 bit positions and 8 bit normals")
+    parser.add_argument("--lod", type=parseLodList, default=None,
+                        help="Lighter versions of the surface files: triangle counts or sizes in %% of the "
+                             "model, like 200k,20k or 0.5%%. Add full to also write the full surface")
+    parser.add_argument("--colormap", choices=sorted(colorMaps), default="rainbow",
+                        help="Colors for the result values in OBJ, WRL, and GLB files (default rainbow)")
+    parser.add_argument("--color-range", type=parseColorRange, default=None,
+                        help="min,max of the colors, so files for different sets match (default is each file's own)")
+    parser.add_argument("--average-bodies", action="store_true",
+                        help="Average elemental results within each body, not across the boundaries between them")
+    parser.add_argument("--mem-cap-mb", type=float, default=None,
+                        help="Keep work arrays under this many MB per worker, spilling big ones to disk")
+    parser.add_argument("--scratch-dir", default=None,
+                        help="Folder for the work arrays that spill to disk (default is the temp folder)")
+    parser.add_argument("--animate", action="store_true",
+                        help="Write one .vtkhdf animation per result type with all of the sets in it")
+    parser.add_argument("--pcntdfl", type=float, default=5.0,
+                        help="Percent deflection distortion (default 5)")
+    parser.add_argument("--scale-mode", choices=("set","global"), default="set",
+                        help="Scale each set's deflection on its own (set) or use the biggest of all the sets (global)")
+    parser.add_argument("--outroot", default=None,
+                        help="Output file root (default is the result file name)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default is the number of CPUs)")
+    parser.add_argument("--cache-mb", type=float, default=4096,
+                        help="Memory budget in MB for the solution cache in each worker (default 4096)")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Print the full translation messages from every job")
+    parser.add_argument("--force", action="store_true",
+                        help="Write every file, even the ones that are up to date with their manifest")
+    parser.add_argument("--dpf-server", default=None,
+                        help="host:port of a DPF server that is already running (default starts one per worker)")
+    parser.add_argument("--metrics-log", default=None,
+                        help="Add the time and memory of every stage of every job to this file as JSON lines")
+    args = parser.parse_args(argv)
+    exportOptions["quantize"] = args.quantize
+    exportOptions["memCapMB"] = args.mem_cap_mb
+    exportOptions["scratchDir"] = args.scratch_dir
+    if args.metrics_log is not None:
+        exportOptions["metricsLog"] = os.path.abspath(args.metrics_log)
+    exportOptions["scaleMode"] = args.scale_mode
+    exportOptions["scaleSets"] = args.sets
+    exportOptions["dpfServer"] = args.dpf_server
+    exportOptions["force"] = args.force
+    exportOptions["colormap"] = args.colormap
+    exportOptions["colorRange"] = args.color_range
+    exportOptions["averageBodies"] = args.average_bodies
+    if args.lod is not None and len(args.lod) > 0:
+        exportOptions["lod"] = args.lod
+    if args.formats is None and not args.animate:
+        parser.error("--formats is needed unless you use --animate")
+    if "all" in args.types and (args.animate or any(ot not in ("vtk","none") for ot in args.formats)):
+        parser.error("The all result type can only be written with --formats vtk")
+
+    rstPath = os.path.abspath(args.rstfile)
+    if not os.path.isfile(rstPath):
+        parser.error("Result file not found: " + rstPath)
+    rstFile = os.path.basename(rstPath)
+    rstDir = os.path.dirname(rstPath)
+    outroot = args.outroot
+    if outroot is None:
+        outroot = os.path.splitext(rstFile)[0]
+    workers = max(1, args.workers)
+
+# 6.5.1: One job for every combination of set and result type, which writes all of the output 
+#        types from one read and distortion (Section 5), 
+#        or for an animation, one job for each result type with all of the sets
+    jobs = []
+    if args.animate:
+        args.formats = ["vtkhdf"]
+        setLbl = str(args.sets[0]) + "-" + str(args.sets[-1])
+        for rt in args.types:
+            jobs.append({"rstnum":setLbl, "rstsets":args.sets, "pcntdfl":args.pcntdfl, "rsttype":rt, 
+                         "rstFile":rstFile, "rstDir":rstDir, "outtype":"vtkhdf", "outroot":outroot})
+    else:
+        for rstnum in args.sets:
+            for rt in args.types:
+                jobs.append({"rstnum":rstnum, "pcntdfl":args.pcntdfl, "rsttype":rt, "rstFile":rstFile,
+                             "rstDir":rstDir, "outtype":",".join(args.formats), "outroot":outroot})
+
+    print("===========================================================================")
+    print("Batch translation of " + rstPath)
+    print("  Sets: " + str(len(args.sets)) + " | Result types: " + ",".join(args.types) + 
+          " | Output types: " + ",".join(args.formats))
+    print("  Jobs: " + str(len(jobs)) + " on " + str(workers) + " worker(s)")
+
+# 6.5.1.1: With a global scale, or for animations, every file uses the biggest deflection of all 
+#          the sets. Work it out once here and hand it to the workers in exportOptions["fixedUmax"], 
+#          so no worker reads every set again. Sets that are not on the file are left out of the 
+#          scale (their own jobs will fail and say so). If it still can't be worked out, stop here 
+#          instead of starting jobs that would all fail the same way. 
+#          Then let go of the file, since each worker loads its own
+    if (args.scale_mode == "global" or args.animate) and any(rt != "tmp" for rt in args.types):
+        try:
+            scaleStart = time.perf_counter()
+            cached = solCache.get(rstPath)
+            missing = [rstnum for rstnum in args.sets if rstnum < 1 or rstnum > cached["nsets"]]
+            scaleSets = [rstnum for rstnum in args.sets if rstnum not in missing]
+            if len(missing) > 0:
+                print("  Sets not on the file (it has " + str(cached["nsets"]) + "), left out of the scale: " + 
+                      ",".join(str(rstnum) for rstnum in missing))
+            if len(scaleSets) == 0:
+                raise ValueError("none of the sets are on the file")
+            exportOptions["scaleSets"] = scaleSets
+            exportOptions["fixedUmax"] = globalUmax(cached,scaleSets)
+            del cached
+            print("  Biggest deflection over all sets: %g (%.2f s)" % 
+                  (exportOptions["fixedUmax"], time.perf_counter()-scaleStart))
+        except Exception as exc:
+            stopDpf()
+            parser.error("Could not find the biggest deflection over the sets: " + 
+                         type(exc).__name__ + ": " + str(exc))
+        stopDpf()
+    print("---------------------------------------------------------------------------", flush=True)
+
+# 6.5.2: Hand the jobs to the pool and report each one as it finishes
+    results = []
+    batchStart = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=initBatchWorker, 
+                             initargs=(args.verbose,args.cache_mb,exportOptions)) as pool:
+        futures = [pool.submit(runBatchJob, job) for job in jobs]
+        for fut in as_completed(futures):
+            res = fut.result()
+            results.append(res)
+            status = "ok  " if res["ok"] else "FAIL"
+            print("[%d/%d] %s %8.2fs  set %s  %s -> %s" % (len(results), len(jobs), status, res["secs"],
+                  res["rstnum"], res["rsttype"], res["outtype"]), flush=True)
+    batchTime = time.perf_counter() - batchStart
+
+# 6.5.3: The summary. Put the jobs back in order, then give the timings and list the failures
+    results.sort(key=lambda r: (r["rstnum"], r["rsttype"], r["outtype"]))
+    failed = [r for r in results if not r["ok"]]
+    times = [r["secs"] for r in results]
+    print("===========================================================================")
+    print("Batch summary")
+    print("  Jobs run: %d | Succeeded: %d | Failed: %d" % (len(results), len(results)-len(failed), len(failed)))
+    if len(times) > 0:
+        print("  Job time (s): total %.2f | mean %.2f | min %.2f | max %.2f" % 
+              (sum(times), sum(times)/len(times), min(times), max(times)))
+    print("  Wall clock time (s): %.2f" % batchTime)
+    checks = [st for r in results for st in r["stages"] if st["stage"] == "manifest"]
+    if len(checks) > 0:
+        print("  Files: %d made, %d up to date and skipped" % 
+              (sum(filesMade(r["stages"]) for r in results), sum(st["skipped"] for st in checks)))
+    nhit = len([r for r in results if r["cacheHit"]])
+    print("  Solution cache: %d hit(s), %d miss(es)" % (nhit, len(results)-nhit))
+    starts = dict((r["dpfStart"][0], r["dpfStart"]) for r in results if r["dpfStart"][2] is not None)
+    if len(starts) > 0:
+        print("  DPF start up per worker (s): imports %.2f | server %.2f | %d worker(s)" % (
+              sum(st[1] for st in starts.values())/len(starts), 
+              sum(st[2] for st in starts.values())/len(starts), len(starts)))
+    stageLines = stageTable([r["stages"] for r in results])
+    if len(stageLines) > 0:
+        print("  Time and memory by stage (peak RSS is the biggest of any worker):")
+        for line in stageLines:
+            print(line)
+    if exportOptions["metricsLog"] is not None:
+        print("  Stage log: " + exportOptions["metricsLog"])
+    if len(failed) > 0:
+        print("---------------------------------------------------------------------------")
+        print("Failed jobs:")
+        for r in failed:
+            print("  set %s  %s -> %s: %s" % (r["rstnum"], r["rsttype"], r["outtype"], r["error"]))
+    print("===========================================================================", flush=True)
+
+    if len(failed) > 0:
+        return 1
+    return 0
+#
+# End of runBatch()
 
-# 5.12.2: Pyansys includes an STL output capability, so me might as well use it
-#         NOTE: STL does not support colors, so this is just a distorted faced file. 
-    elif outtype == "stl":
-        stlop = coreops.mesh.stl_export()
-        stlop.inputs.mesh.connect(dflmesh)
-        stlop.inputs.file_path.connect(outfname+".stl")
-
-        stlop.run()
-
-#5.12.3: OBJ and WRL need to use teh pyVista modules to write a file. 
-#        Many of the steps are the same so we start by 
-#     The pyvista module does not work with the Ansys mesh object, 
-#     so you have to do some fancy converstion to get the mesh into a 
-#     grid it can use
-#     It also doesn't automatically handle element values vs nodal value, 
-#     so we have to handle that
-#     We set things up the same for OBJ and WRL, then use different functions to do the actual export
-    elif outtype == "obj" or outtype == "wrl":
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#
+#  ##### SECTION 7 #####
+#
+#  The solution cache. Opening a big result file and reading the mesh is the slowest part of 
+#    making a file, and it is the same every time you make another file from the same result file. 
+#    So we keep the loaded solution, the mesh, and things we calculate from the mesh (like the 
+#    model extents) around in memory. 
+#
+#    - An entry is found using the full path, size, and modified time of the file, so if the 
+#      solver writes a new file with the same name, we load it again
+#    - When the entries add up to more memory than the budget, the one used longest ago is removed
+#    - We count the hits and misses so we can tell if the cache is doing any good
+#
+class SolutionCache:
+
+# 7.1: Set up an empty cache with a memory budget in megabytes
+    def __init__(self,budgetMB=4096):
+        self.budget = int(budgetMB*1024*1024)
+        self.entries = OrderedDict()
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+# 7.2: The key is the full path plus the size and modified time of the file
+    def makeKey(self,rstPath):
+        rstPath = os.path.abspath(rstPath)
+        st = os.stat(rstPath)
+        return (rstPath, st.st_size, st.st_mtime_ns)
+
+# 7.3: Get the entry for a result file, loading it if it is not already here. 
+#      Returns a dictionary with the solution, mesh, and the data we derive from the mesh
+    def get(self,rstPath):
+        key = self.makeKey(rstPath)
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                entry = self.entries[key]
+                entry["hit"] = True
+                return entry
+
+            self.misses += 1
+# The file changed on disk, so anything we have for the old version is no good
+            for oldKey in [k for k in self.entries if k[0] == key[0]]:
+                self.remove(oldKey)
+
+            entry = self.load(key[0])
+            self.entries[key] = entry
+            self.used += entry["nbytes"]
+            self.trim()
+            entry["hit"] = False
+            return entry
+
+# 7.4: Load the solution and mesh, see how many result sets there are, and calculate the model extents. 
+#      Take the min and max of the nodal coordinates with numpy, then the biggest X, Y, or Z 
+#      dimension is what the deflection gets scaled against. 
+#      The biggest deflection of each set goes in "umax" as it gets worked out (Section 8)
+    def load(self,rstPath):
+        startDpf()
+        mysol = post.load_solution(rstPath)
+        mymesh = mysol.mesh
+
+        nsets = mysol.time_freq_support.n_sets
+
+        coords = np.asarray(mymesh.nodes.coordinates_field.data, dtype=float)
+        coordmin = np.nanmin(coords, axis=0)
+        coordmax = np.nanmax(coords, axis=0)
+        dltmax = float(np.max(coordmax-coordmin))
+        del coords
+
+        return {"path":rstPath, "sol":mysol, "mesh":mymesh, 
+                "coordmin":coordmin, "coordmax":coordmax, "dltmax":dltmax, "nsets":nsets,
+                "nbytes":self.meshBytes(mymesh), "derived":{}, "umax":{}}
+
+# 7.5: We can't ask DPF how much memory a mesh takes up, so estimate it from the number of 
+#      nodes (3 coordinates and an ID) and elements (connectivity, type, and ID). 
+#      Good enough to decide when to throw things out
+    def meshBytes(self,mymesh):
+        nnode = mymesh.nodes.n_nodes
+        nelem = mymesh.elements.n_elements
+        return nnode*(3*8 + 4) + nelem*(20*4 + 3*4)
+
+# 7.6: Other things we work out from the mesh, like the outside surface (Section 12), are kept 
+#      in the entry too. makeIt() is only called the first time and returns a dictionary of numpy arrays. 
+#      Their size is added to the entry so they count against the memory budget
+    def derived(self,entry,name,makeIt):
+        with self.lock:
+            if name not in entry["derived"]:
+                value = makeIt()
+                nbytes = sum(a.nbytes for a in value.values() if isinstance(a,np.ndarray))
+                entry["derived"][name] = value
+                entry["nbytes"] += nbytes
+                if any(e is entry for e in self.entries.values()):
+                    self.used += nbytes
+                    self.trim()
+            return entry["derived"][name]
+
+# 7.7: Drop the oldest entries until we are under budget. Always keep the newest one, 
+#      even if it is bigger than the budget all by itself
+    def trim(self):
+        with self.lock:
+            while self.used > self.budget and len(self.entries) > 1:
+                oldKey = next(iter(self.entries))
+                self.remove(oldKey)
+                self.evictions += 1
+
+    def remove(self,key):
+        with self.lock:
+            entry = self.entries.pop(key)
+            self.used -= entry["nbytes"]
+
+# 7.8: Change the memory budget, which may throw some entries out
+    def setBudget(self,budgetMB):
+        with self.lock:
+            self.budget = int(budgetMB*1024*1024)
+            self.trim()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.used = 0
+
+# 7.9: Counters, as a dictionary for the batch summary and as a line of text for the text zone
+    def stats(self):
+        with self.lock:
+            return {"hits":self.hits, "misses":self.misses, "evictions":self.evictions,
+                    "entries":len(self.entries), "usedMB":self.used/1024/1024, 
+                    "budgetMB":self.budget/1024/1024}
+
+    def summary(self):
+        st = self.stats()
+        return "%d hit(s), %d miss(es), %d file(s) using %.1f of %.0f MB" % (
+            st["hits"], st["misses"], st["entries"], st["usedMB"], st["budgetMB"])
+#
+# End of SolutionCache
 
-# Get the result field and the deflected mesh into some variables. 
-        field = rstval[0]
-        meshed_region = dflmesh
+# 7.10: There is one cache for the whole program (each batch worker process gets its own)
+solCache = SolutionCache()
 
-# We are going to need the name of the field in "field" 
-# in order to grab it later
-        fieldName = '_'.join(field.name.split("_")[:-1])
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#
+#  ##### SECTION 8 #####
+#
+#  Reading results from one solution set. Reading results off a big file takes a long time, 
+#    so this only reads what is asked for and it remembers what it already read. 
+#    - Every displacement type (u, ux, uy, uz, usum) comes from one read of the displacement vector,
+#      and that same read is used to distort the mesh
+#    - Every stress type comes from one read of the stress tensor. The components are pulled out 
+#      of the tensor, and the principal and von Mises stresses are calculated from it with DPF operators
+#    - Nothing is read until it is asked for, so a displacement file never touches the stresses
+#
+# 8.1: Which component of the displacement vector or stress tensor goes with each result type.
+#      DPF stores a stress tensor as XX, YY, ZZ, XY, YZ, XZ
+dispComps = {"ux":0, "uy":1, "uz":2}
+stressComps = {"sx":0, "sy":1, "sz":2, "xy":3, "yz":4, "xz":5}
+principalTypes = ("s1","s2","s3")
+
+class SetResults:
+
+# 8.2: Nothing gets read here, we just remember which solution and set to read from
+    def __init__(self,mysol,rstnum,nsets=None):
+        self.sol = mysol
+        self.rstnum = rstnum
+        self.nsets = nsets
+        self.read = {}
+
+# 8.3: Make sure the set number is on the file before we try and read anything
+    def checkSet(self):
+        if self.nsets is not None and (self.rstnum < 1 or self.rstnum > self.nsets):
+            raise ValueError("Result set " + str(self.rstnum) + " is not on the file (1 to " + 
+                             str(self.nsets) + ")")
+
+# 8.4: The raw reads from the file. Each one happens at most once for this set
+    def dispVector(self):
+        if "u" not in self.read:
+            self.read["u"] = self.sol.displacement(set=self.rstnum).vector.result_fields_container
+        return self.read["u"]
+
+    def stressTensor(self):
+        if "stress" not in self.read:
+            self.read["stress"] = self.sol.stress(set=self.rstnum).tensor.result_fields_container
+        return self.read["stress"]
+
+    def temperature(self):
+        if "tmp" not in self.read:
+            self.read["tmp"] = self.sol.temperature(set=self.rstnum).scalar.result_fields_container
+        return self.read["tmp"]
+
+# 8.5: The principal stresses all come out of the same operator, so run it once and keep all three
+    def principals(self):
+        if "s1" not in self.read:
+            prnop = dpf.operators.invariant.principal_invariants_fc(fields_container=self.stressTensor())
+            self.read["s1"] = prnop.outputs.fields_eig_1()
+            self.read["s2"] = prnop.outputs.fields_eig_2()
+            self.read["s3"] = prnop.outputs.fields_eig_3()
+        return self.read["s1"], self.read["s2"], self.read["s3"]
+
+# 8.6: Get the fields container for any of the result types in rsttype_list
+    def fields(self,rsttype):
+        if rsttype in self.read:
+            return self.read[rsttype]
 
-    # Look in the field to see if the location of the results is nodal or elemental
-        location = field.location
+        if rsttype == "u":
+            return self.dispVector()
+        elif rsttype == "tmp":
+            return self.temperature()
+        elif rsttype in principalTypes:
+            return self.principals()[principalTypes.index(rsttype)]
+        elif rsttype in dispComps:
+            compop = dpf.operators.logic.component_selector_fc(self.dispVector(), dispComps[rsttype])
+            fc = compop.outputs.fields_container()
+        elif rsttype == "usum":
+            fc = dpf.operators.math.norm_fc(self.dispVector()).outputs.fields_container()
+        elif rsttype in stressComps:
+            compop = dpf.operators.logic.component_selector_fc(self.stressTensor(), stressComps[rsttype])
+            fc = compop.outputs.fields_container()
+        elif rsttype == "seqv":
+            fc = dpf.operators.invariant.von_mises_eqv_fc(self.stressTensor()).outputs.fields_container()
+        else:
+            raise ValueError("Unknown result type: " + rsttype)
+
+        self.read[rsttype] = fc
+        return fc
+
+# 8.6.1: Every result for the "all" result type, as numpy arrays that line up with the mesh. 
+#        Each raw result is read once: the displacement vector gives ux, uy, uz, and usum, 
+#        the stress tensor gives the six components, the principals, and von Mises (8.13), 
+#        and thermal files give tmp. A kind of result the solution does not have (a thermal 
+#        solution has no displacement or stress method) is left out and listed in self.omitted. 
+#        Any other error reading a result is a real failure and is not caught here, so 
+#        createResultFile() stops and no file or manifest is written for a partial read. 
+#        Returns a dictionary of (values, location) for each result name
+    def allResults(self,cached):
+        if "all" in self.read:
+            return self.read["all"]
+        found = OrderedDict()
+        self.omitted = []
+        if hasattr(self.sol,"displacement"):
+            disp, loc = gatherField(self.dispVector(),cached)
+            for name in dispComps:
+                found[name] = (disp[:,dispComps[name]], loc)
+            found["usum"] = (np.sqrt(np.einsum("ij,ij->i", disp, disp)), loc)
+            del disp
+        else:
+            self.omitted.append("displacement")
+        if hasattr(self.sol,"stress"):
+            tensor, loc = gatherField(self.stressTensor(),cached)
+            stress = stressQuantities(tensor)
+            for name in stress:
+                found[name] = (stress[name], loc)
+            del tensor, stress
+        else:
+            self.omitted.append("stress")
+        if len(found) == 0:
+            if not hasattr(self.sol,"temperature"):
+                raise LookupError("No displacement, stress, or temperature results on the file")
+            found["tmp"] = gatherField(self.temperature(),cached)
+        self.read["all"] = found
+        return found
+#
+# End of SetResults
+
+# 8.7: The biggest deflection in a displacement fields container. 
+#      This is the biggest length of the displacement vector, not the biggest X, Y, or Z value, 
+#      so a node that moves diagonally counts fully. The squared length is worked out a block of 
+#      nodes at a time (Section 14) and NaNs are skipped
+def maxDeflection(usumval):
+    umax2 = 0.0
+    for field in usumval:
+        data = np.asarray(field.data)
+        data = data.reshape(len(data),-1)
+        step = chunkRows(8*8)
+        for i in range(0, len(data), step):
+            blk = data[i:i+step]
+            mag2 = np.einsum("ij,ij->i", blk, blk)
+            umax2 = max(umax2, float(np.max(mag2, initial=0.0, where=~np.isnan(mag2))))
+    return float(np.sqrt(umax2))
+
+# 8.8: Put the values in a fields container into a numpy array that lines up with the 
+#      nodes or elements of the mesh, so it can go straight into a file or a grid. 
+#      A model with more than one body or material has a field for each one, so every field 
+#      in the container goes into the array. 
+#      Anything the fields do not have a value for is NaN. 
+#      Returns the array and the location (dpf.locations.nodal or dpf.locations.elemental)
+def gatherField(fc,cached):
+    location = fc[0].location
+    if location not in (dpf.locations.nodal, dpf.locations.elemental):
+        raise ValueError(
+            "Only elemental or nodal location are supported for plotting."
+        )
+    idx, count = idIndex(cached,location)
+
+# Stack the IDs and values of all of the fields, then put them in place in one go
+    ids = []
+    data = []
+    for field in fc:
+        if field.location != location:
+            raise ValueError("All of the fields in a result must be nodal or all elemental")
+        ids.append(np.asarray(field.scoping.ids, dtype=np.int64))
+        data.append(np.asarray(field.data))
+    ids = np.concatenate(ids)
+    data = np.concatenate(data)
+
+    ind = lookupIds(idx,ids)
+    mask = ind >= 0
+
+    overall_data = np.full((count,) + data.shape[1:], np.nan)
+    overall_data[ind[mask]] = data[mask]
+    return overall_data, location
+
+# 8.9: The index of every node or element ID in the mesh, so we can look IDs up with lookupIds(). 
+#      This only depends on the mesh, so it is made once and kept in the solution cache. 
+#      Usually the IDs are close to 1 to N, and the index is an array with lookup[ID] the index, 
+#      or -1 if there is no node or element with that ID. Meshes from external models can have 
+#      IDs up in the billions, where that array would be GB even for a small mesh. So if the 
+#      biggest ID is more than idSpread times the count, we keep the IDs sorted instead and 
+#      look them up with a binary search (np.searchsorted). 
+#      Returns the index and the number of nodes or elements
+idSpread = 4
+
+def idIndex(cached,location):
+    def makeIt():
         if location == dpf.locations.nodal:
-            mesh_location = meshed_region.nodes
-        elif location == dpf.locations.elemental:
-            mesh_location = meshed_region.elements
+            meshIds = np.asarray(cached["mesh"].nodes.scoping.ids, dtype=np.int64)
         else:
-            raise ValueError(
-                "Only elemental or nodal location are supported for plotting."
-            )
-        
-# Next we are going to use a mask to get a grid them assign resutls to 
-# either the element or nodal data
-        overall_data = np.full(len(mesh_location), np.nan)
-        ind, mask = mesh_location.map_scoping(field.scoping)
-        overall_data[ind] = field.data[mask]
-        grid = meshed_region.grid
+            meshIds = np.asarray(cached["mesh"].elements.scoping.ids, dtype=np.int64)
+        maxId = int(meshIds.max()) if len(meshIds) > 0 else -1
+        if maxId < idSpread*len(meshIds) + 1024:
+            lookup = np.full(maxId+1, -1, dtype=np.int64)
+            lookup[meshIds] = np.arange(len(meshIds))
+            return {"lookup":lookup, "count":np.array(len(meshIds))}
+        order = np.argsort(meshIds, kind="stable")
+        return {"sortedIds":meshIds[order], "order":order, "count":np.array(len(meshIds))}
+    idx = solCache.derived(cached,"ids-"+location,makeIt)
+    return idx, int(idx["count"])
+
+# 8.9.1: The mesh index of each ID in ids, -1 for IDs that are not in the mesh
+def lookupIds(idx,ids):
+    ind = np.full(len(ids), -1, dtype=np.int64)
+    if "lookup" in idx:
+        lookup = idx["lookup"]
+        inrange = (ids >= 0) & (ids < len(lookup))
+        ind[inrange] = lookup[ids[inrange]]
+    elif len(idx["sortedIds"]) > 0:
+        sortedIds = idx["sortedIds"]
+        pos = np.minimum(np.searchsorted(sortedIds, ids), len(sortedIds)-1)
+        found = sortedIds[pos] == ids
+        ind[found] = idx["order"][pos[found]]
+    return ind
+
+# 8.10: The biggest deflection of one set. It is kept in the cache entry, so each set is only 
+#       worked out once for as long as the file stays in the cache. If the displacements were 
+#       not already read, read them here
+def setUmax(cached,rstnum,usumval=None):
+    with solCache.lock:
+        if rstnum in cached["umax"]:
+            return cached["umax"][rstnum]
+    if usumval is None:
+        setres = SetResults(cached["sol"],rstnum,cached["nsets"])
+        setres.checkSet()
+        usumval = setres.dispVector()
+    umax = maxDeflection(usumval)
+    with solCache.lock:
+        cached["umax"][rstnum] = umax
+    return umax
+
+# 8.11: The biggest deflection over a list of sets, or every set on the file if rstsets is None. 
+#       Used for the "global" scale mode and animations, so every frame or file has the same scale
+def globalUmax(cached,rstsets=None):
+    if rstsets is None:
+        rstsets = range(1,cached["nsets"]+1)
+    umax = 0.0
+    for rstnum in rstsets:
+        umax = max(umax, setUmax(cached,rstnum))
+        checkCancel()
+    return umax
+
+# 8.12: The scale factor for the distortion: the percentage of the model size over the biggest 
+#       deflection. Which deflection depends on exportOptions: one given up front (fixedUmax), 
+#       the biggest over the sets ("global"), or the biggest in this set ("set"). 
+#       A set that doesn't move gets no distortion instead of a divide by zero
+def scaleFactor(cached,pcntdfl,rstnum,usumval=None):
+    if exportOptions["fixedUmax"] is not None:
+        umax = exportOptions["fixedUmax"]
+    elif exportOptions["scaleMode"] == "global":
+        if usumval is not None:
+            setUmax(cached,rstnum,usumval)
+        umax = globalUmax(cached,exportOptions["scaleSets"])
+    else:
+        umax = setUmax(cached,rstnum,usumval)
+    if umax <= 0.0:
+        return 0.0
+    return pcntdfl/100.0*cached["dltmax"]/umax
+
+# 8.13: Every stress result from the stress tensor, with numpy instead of a DPF operator for each. 
+#       tensor has a row of XX, YY, ZZ, XY, YZ, XZ for each node or element. 
+#       The principals are the eigenvalues of the 3x3 tensor, which eigvalsh() does for a whole 
+#       block of rows at once (smallest first, so s1 is the last one). 
+#       Rows with a NaN (nodes that have no stress) stay NaN. 
+#       The component names come from stressComps, so the arrays in the "all" file have the same 
+#       names as the single result types
+stressNames = tuple(sorted(stressComps, key=stressComps.get)) + principalTypes + ("seqv",)
+
+def stressQuantities(tensor):
+    tensor = np.asarray(tensor, dtype=np.float64)
+    out = OrderedDict()
+    for k, name in enumerate(stressNames[:6]):
+        out[name] = tensor[:,k].copy()
+    for name in principalTypes:
+        out[name] = np.full(len(tensor), np.nan)
+
+    step = chunkRows(12*8)
+    for i in range(0, len(tensor), step):
+        blk = tensor[i:i+step]
+        rows = np.nonzero(np.all(np.isfinite(blk), axis=1))[0]
+        t = blk[rows]
+        mat = np.empty((len(t),3,3))
+        mat[:,0,0] = t[:,0]
+        mat[:,1,1] = t[:,1]
+        mat[:,2,2] = t[:,2]
+        mat[:,0,1] = mat[:,1,0] = t[:,3]
+        mat[:,1,2] = mat[:,2,1] = t[:,4]
+        mat[:,0,2] = mat[:,2,0] = t[:,5]
+        eig = np.linalg.eigvalsh(mat)
+        out["s1"][i+rows] = eig[:,2]
+        out["s2"][i+rows] = eig[:,1]
+        out["s3"][i+rows] = eig[:,0]
+
+    sx, sy, sz = out["sx"], out["sy"], out["sz"]
+    out["seqv"] = np.sqrt(0.5*((sx-sy)**2 + (sy-sz)**2 + (sz-sx)**2) + 
+                          3.0*(out["xy"]**2 + out["yz"]**2 + out["xz"]**2))
+    return out
+
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#
+#  ##### SECTION 9 #####
+#
+#  Running translations in the background. A big result file can take minutes to read, and if we 
+#    did that on the main thread the window would freeze. So when the user clicks Translate, 
+#    doTranslate() puts the job on a queue and a worker thread runs createResultFile() for each job
+#    in turn. The user can keep queueing jobs while one is running.
+#
+#    TK is not thread safe, so the worker never touches the window. Everything it wants to show 
+#    (text, progress, plots) goes on a message queue, and the main thread checks that queue 
+#    every 100 ms with after() in pollMessages().
+#
+#    Cancel throws away the queued jobs and asks the running one to stop. A DPF read can't be 
+#    interrupted, so the running job stops at the next checkCancel() in createResultFile()
+#
+# 9.1: The queues, flags, and a little bit of state for the status line
+class TranslationCancelled(Exception):
+    pass
+
+jobQueue = queue.Queue()
+msgQueue = queue.Queue()
+cancelFlag = threading.Event()
+busyFlag = threading.Event()
+workerThread = None
+jobState = {"running":None, "queued":0, "done":0}
+
+# 9.2: Put a job on the queue, and start the worker thread if this is the first one
+#      The options from the window go with it on top of a copy of the export options. The worker 
+#      puts them in exportOptions when it starts the job, so changing them in the window does not 
+#      change the job that is running or the ones that are queued
+def queueJob(job,options):
+    global workerThread
+    if workerThread is None:
+        workerThread = threading.Thread(target=translateWorker, name="translateWorker", daemon=True)
+        workerThread.start()
+    jobQueue.put((job,dict(exportOptions,**options)))
+    jobState["queued"] += 1
+    tzPrint(textZone,"Queued: " + jobName(job))
+    updateStatus()
+
+def jobName(job):
+    return job[2] + " set " + str(job[0]) + " -> " + job[5]
+
+# 9.3: The worker thread. Take jobs off the queue one at a time and run them. 
+#      Errors are sent to the text zone so one bad job does not kill the worker
+def translateWorker():
+    while True:
+        job, options = jobQueue.get()
+        exportOptions.update(options)
+        busyFlag.set()
+        msgQueue.put(("start",job))
+        try:
+            createResultFile(*job)
+        except TranslationCancelled:
+            tzPrint(textZone,"###################################################################")
+            tzPrint(textZone,"    Translation cancelled: " + jobName(job))
+            tzPrint(textZone,"###################################################################")
+        except Exception as exc:
+            tzPrint(textZone,"###################################################################")
+            tzPrint(textZone,"    ERROR in " + jobName(job))
+            tzPrint(textZone,"    " + type(exc).__name__ + ": " + str(exc))
+            tzPrint(textZone,"###################################################################")
+        cancelFlag.clear()
+        busyFlag.clear()
+        msgQueue.put(("finish",job))
+
+# 9.4: Cancel. Empty the job queue, then flag the running job to stop
+def cancelJobs():
+    dropped = 0
+    while True:
+        try:
+            jobQueue.get_nowait()
+            dropped += 1
+        except queue.Empty:
+            break
+    jobState["queued"] -= dropped
+    if busyFlag.is_set():
+        cancelFlag.set()
+    if textZone is not None and (dropped > 0 or busyFlag.is_set()):
+        tzPrint(textZone,"Cancelling: " + str(dropped) + " queued job(s) removed")
+        updateStatus()
+
+# 9.5: createResultFile() calls this between steps. If the user pressed Cancel, stop here
+def checkCancel():
+    if cancelFlag.is_set():
+        raise TranslationCancelled()
+
+# 9.6: Progress of the running job, as a percentage. Only the GUI has a progress bar
+def tzProgress(pct):
+    if textZone is None:
+        return
+    if threading.current_thread() is not threading.main_thread():
+        msgQueue.put(("progress",pct))
+    else:
+        progVar.set(pct)
+
+# 9.7: Plot windows have to be opened by the main thread, so a background job sends the 
+#      result values and the distorted mesh over and pollMessages() does the plot. 
+#      The values are for every body, so they go on the pyvista grid of the mesh and we plot that
+def showPlot(vals,location,dflmesh,name):
+    if textZone is not None and threading.current_thread() is not threading.main_thread():
+        msgQueue.put(("plot",vals,location,dflmesh,name))
+    else:
+        drawPlot(vals,location,dflmesh,name)
+
+def drawPlot(vals,location,dflmesh,name):
+    loadAnsys()
+    grid = dflmesh.grid
+    if location == dpf.locations.nodal:
+        grid.point_data[name] = vals
+    else:
+        grid.cell_data[name] = vals
+
+    plt = pv.Plotter()
+    plt.add_mesh(grid, scalars=name, show_edges=False) 
+
+#display the plot      
+    plt.show_axes()
+    plt.set_background("#aaaaaa")
+    plt.show()
+
+# 9.8: The main thread calls this every 100 ms. Handle whatever the worker sent over, 
+#      then update the status line and schedule the next check
+def pollMessages():
+    for i in range(500):
+        try:
+            msg = msgQueue.get_nowait()
+        except queue.Empty:
+            break
+        kind = msg[0]
+        if kind == "line":
+            tzPrint(textZone,msg[1])
+        elif kind == "progress":
+            progVar.set(msg[1])
+        elif kind == "plot":
+            drawPlot(*msg[1:])
+        elif kind == "start":
+            jobState["running"] = msg[1]
+            jobState["queued"] -= 1
+            progVar.set(0)
+        elif kind == "finish":
+            jobState["running"] = None
+            jobState["done"] += 1
+            progVar.set(0)
+    updateStatus()
+    myDialog.after(100,pollMessages)
+
+def updateStatus():
+    if jobState["running"] is None:
+        running = "idle"
+    else:
+        running = "running " + jobName(jobState["running"])
+    statusLbl.configure(text="Status: %s | Queued: %d | Done: %d" % 
+                        (running, max(jobState["queued"],0), jobState["done"]))
+#
+# End of Section 9
+
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#
+#  ##### SECTION 10 #####
+#
+#  Animations. To see every time point or mode shape, we write all of the sets into one VTKHDF file 
+#    with transient data (ParaView 5.12 or newer reads these as an animation). 
+#    Making one file per set would copy the mesh and write the connectivity over and over, 
+#    so here the topology (connectivity, offsets, cell types) is written once and each frame only 
+#    adds the distorted nodal coordinates and the result values. Each frame is written to the 
+#    file as soon as it is made, so the memory used does not grow with the number of frames.
+#
+#    All frames use the same scale factor, found from the biggest deflection over all of the sets, 
+#    so the distortion is consistent from frame to frame.
+#
+#    Writing HDF5 files needs the h5py module: pip install h5py
+#
+# 10.1: A class that writes the VTKHDF file. Make it with the topology, then call addFrame() 
+#       for each set and close() at the end. 
+#       Every array that grows with the frames is made resizable and gets added to as we go
+class VtkHdfSeries:
+
+    def __init__(self,fname,connectivity,offsets,celltypes,npts):
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError("Writing animations needs the h5py module: pip install h5py")
+
+        self.npts = int(npts)
+        self.ncells = len(celltypes)
+        self.nsteps = 0
+        self.h5 = h5py.File(fname,"w")
+
+# 10.1.1: The header and the topology. This is only written once
+        root = self.h5.create_group("VTKHDF")
+        root.attrs["Version"] = (2,0)
+        gtype = "UnstructuredGrid".encode("ascii")
+        root.attrs.create("Type", gtype, dtype=h5py.string_dtype("ascii",len(gtype)))
+        root.create_dataset("NumberOfPoints", data=np.array([self.npts], dtype=np.int64))
+        root.create_dataset("NumberOfCells", data=np.array([self.ncells], dtype=np.int64))
+        root.create_dataset("NumberOfConnectivityIds", data=np.array([len(connectivity)], dtype=np.int64))
+        root.create_dataset("Types", data=np.asarray(celltypes, dtype=np.uint8))
+        root.create_dataset("Offsets", data=np.asarray(offsets, dtype=np.int64))
+        root.create_dataset("Connectivity", data=np.asarray(connectivity, dtype=np.int64))
+
+# 10.1.2: The arrays that get added to each frame. Points are chunked a frame at a time
+        chunk = max(1,min(self.npts,65536))
+        root.create_dataset("Points", shape=(0,3), maxshape=(None,3), chunks=(chunk,3), dtype=np.float64)
+        root.create_group("PointData")
+        root.create_group("CellData")
+        self.root = root
+
+# 10.1.3: The Steps group says where each frame starts in the arrays. The topology never moves, 
+#         so the cell and connectivity offsets are always zero
+        steps = root.create_group("Steps")
+        steps.create_group("PointDataOffsets")
+        steps.create_group("CellDataOffsets")
+        for name in ("Values","PartOffsets","NumberOfParts","PointOffsets"):
+            steps.create_dataset(name, shape=(0,), maxshape=(None,), 
+                                 dtype=np.float64 if name == "Values" else np.int64)
+        for name in ("CellOffsets","ConnectivityIdOffsets"):
+            steps.create_dataset(name, shape=(0,1), maxshape=(None,1), dtype=np.int64)
+        self.steps = steps
+
+# 10.2: Add one value to the end of a resizable dataset
+    def append(self,dset,values):
+        values = np.asarray(values)
+        n = dset.shape[0]
+        dset.resize(n+values.shape[0], axis=0)
+        dset[n:] = values
+        return n
+
+# 10.3: Add a frame: the time or frequency, the distorted coordinates, and the result values. 
+#       location says if the values go on the nodes (point data) or elements (cell data)
+    def addFrame(self,value,points,values,location,name):
         if location == dpf.locations.nodal:
-            grid.point_data[fieldName] = overall_data
-        elif location == dpf.locations.elemental:
-            grid.cell_data[fieldName] = overall_data
-
-# Now that we have a grid and values on the grid, 
-#     use the pyvista plotter operator to make the file. Use the proper export for OBJ or WRL
-        objplt = pv.Plotter()
-        objplt.add_mesh(grid) #close, data is not lined up with nodes
-        if outtype == "obj":
-            objplt.export_obj(outfname+".obj")
-        elif outtype == "wrl":
-            objplt.export_vrml(outfname+".wrl")
-        
-# Remove the meshed_region object in case the user wants to write more files
-        del meshed_region
+            grp, ogrp, count = self.root["PointData"], self.steps["PointDataOffsets"], self.npts
+        else:
+            grp, ogrp, count = self.root["CellData"], self.steps["CellDataOffsets"], self.ncells
+        values = np.asarray(values, dtype=np.float64)
+        if name not in grp:
+            chunk = (max(1,min(count,65536)),) + values.shape[1:]
+            grp.create_dataset(name, shape=(0,)+values.shape[1:], maxshape=(None,)+values.shape[1:],
+                               chunks=chunk, dtype=np.float64)
+            ogrp.create_dataset(name, shape=(0,), maxshape=(None,), dtype=np.int64)
+
+        ptoff = self.append(self.root["Points"], np.asarray(points, dtype=np.float64))
+        dtoff = self.append(grp[name], values)
+        self.append(ogrp[name], [dtoff])
+        self.append(self.steps["Values"], [value])
+        self.append(self.steps["PartOffsets"], [0])
+        self.append(self.steps["NumberOfParts"], [1])
+        self.append(self.steps["PointOffsets"], [ptoff])
+        self.append(self.steps["CellOffsets"], [[0]])
+        self.append(self.steps["ConnectivityIdOffsets"], [[0]])
+        self.nsteps += 1
+        self.h5.flush()
+
+    def close(self):
+        self.steps.attrs["NSteps"] = self.nsteps
+        self.h5.close()
+#
+# End of VtkHdfSeries
 
-# 5.13: Since this is now a GUI, the user can modify the inputs and make more files, so we need to remove
-#       objects so we can make them new again
-        del mysol, mymesh, newcoord,  overall_data
- 
-# 5.14: All done. Let the user know they can keep going or exit. 
+# 10.4: This is the animation version of createResultFile(). It takes a list of set numbers 
+#       instead of just one, and always makes a .vtkhdf file
+def createAnimationFile(rstsets,pcntdfl,rsttype,rstFile,rstDir,outroot):
+
+# 10.4.1: Build the output file name and tell the user what we are doing
+    outfname = outroot + "-" + rsttype + "-anim"
+    fullOutFname = os.path.join(rstDir,outfname+".vtkhdf")
+
+    tzPrint (textZone,"===========================================================================")
+    tzPrint (textZone,"Starting an animation of your Ansys results")
+    tzPrint (textZone,"  Input file: "+rstFile)
+    tzPrint (textZone,"  Solution Steps/modes: "+str(len(rstsets))+" ("+str(rstsets[0])+" to "+str(rstsets[-1])+")")
+    tzPrint (textZone,"  Result type: "+rsttype)
+    tzPrint (textZone,"  Percent deflection distortion: "+str(pcntdfl))
+    tzPrint (textZone,"  Output file: "+outfname+".vtkhdf")
+    tzPrint (textZone,"---------------------------------------------------------------------------")
+
+    cached = solCache.get(os.path.join(rstDir,rstFile))
+    mysol = cached["sol"]
+    mymesh = cached["mesh"]
+    tfreq = mysol.time_freq_support.time_frequencies.data
+
+# 10.4.2: One scale factor for every frame. Go through the sets and find the biggest 
+#         deflection, only holding on to one set at a time. The deflection of each set is kept 
+#         in the cache (Section 8), so sets we already looked at are not read again, and if the 
+#         batch mode already found it (fixedUmax) we don't read any
+    sclfact = 0.0
+    try:
+        if rsttype != "tmp":
+            tzPrint (textZone,"++ Finding the biggest deflection over all of the sets")
+            if exportOptions["fixedUmax"] is not None:
+                umax = exportOptions["fixedUmax"]
+            else:
+                umax = globalUmax(cached,rstsets)
+            if umax > 0.0:
+                sclfact = pcntdfl/100.0*cached["dltmax"]/umax
+            tzPrint (textZone,"   Scale factor for all frames: %g" % sclfact)
+        else:
+            for rstnum in rstsets:
+                SetResults(mysol,rstnum,cached["nsets"]).checkSet()
+    except TranslationCancelled:
+        raise
+    except:
+        tzPrint (textZone,"###################################################################")
+        tzPrint (textZone,"    ERROR")
+        tzPrint (textZone,"Could not find the result you are looking for on the result file")
+        tzPrint (textZone,"   Change the requested result type, numbers, or the file")
+        tzPrint (textZone,"###################################################################")
+        return FALSE
+
+# 10.4.3: Write the topology. The grid from DPF has its points in the same order as the mesh nodes
+    tzPrint (textZone,"++ Writing the mesh topology")
+    grid = mymesh.grid
+    coords = cachedCoords(cached)
+    points = workArray(coords.shape)
+    series = VtkHdfSeries(fullOutFname, grid.cell_connectivity, grid.cell_offsets, grid.celltypes, len(coords))
+
+# 10.4.4: Now one frame at a time: read the set, distort the coordinates, write it, and let it go
+#         The same points array is used for every frame (Section 14)
+    tzPrint (textZone,"++ Writing " + str(len(rstsets)) + " frames")
+    try:
+        for k, rstnum in enumerate(rstsets):
+            setres = SetResults(mysol,rstnum,cached["nsets"])
+            vals, location = gatherField(setres.fields(rsttype),cached)
+            points[:] = coords
+            if rsttype != "tmp":
+                distortInPlace(points,coords,setres.dispVector(),cached,sclfact)
+            series.addFrame(float(tfreq[rstnum-1]), points, vals, location, rsttype)
+            del setres, vals
+            checkCancel()
+            tzProgress(100.0*(k+1)/len(rstsets))
+    finally:
+        series.close()
+
+# 10.4.5: All done
     tzPrint (textZone,"---------------------------------------------------------------------------")
     tzPrint (textZone,"File Created: " + fullOutFname)
+    tzPrint (textZone,"Solution cache: " + solCache.summary())
     tzPrint (textZone, " ")
-    tzPrint (textZone, "Please change the input values to create a new file or if you are finished, click Close")
+    return TRUE
 #
-# End of createResultFile()
+# End of createAnimationFile()
+
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#
+#  ##### SECTION 11 #####
+#
+#  Writing OBJ, STL, and WRL files ourselves. The first version of this program put the grid in a pyvista 
+#    plot window and used the window's export for OBJ and WRL. That needs a graphics context, takes a lot of memory, 
+#    and the result values did not line up with the nodes. 
+#    Instead, we take the outside surface as numpy arrays (points, triangles, normals, colors) and 
+#    write them out a big block of lines at a time. There are no loops over the elements in python.
+#
+# 11.1: The colors used for the results, blue at the minimum to red at the maximum like Mechanical. 
+#       Values with no result (NaN) are gray
+rainbowColors = np.array([[0.0, 0.0, 1.0],
+                          [0.0, 1.0, 1.0],
+                          [0.0, 1.0, 0.0],
+                          [1.0, 1.0, 0.0],
+                          [1.0, 0.0, 0.0]])
+nanColor = np.array([0.5, 0.5, 0.5])
+
+# 11.1.1: The other color maps you can pick with exportOptions["colormap"], each a list of colors 
+#         evenly spaced from the minimum to the maximum. viridis reads well in gray and for color 
+#         blind people, coolwarm is for results that go from negative to positive, and gray is for 
+#         printing. The "-r" versions go the other way
+colorMaps = {"rainbow":rainbowColors,
+             "viridis":np.array([[0.267, 0.005, 0.329],
+                                 [0.231, 0.322, 0.545],
+                                 [0.129, 0.569, 0.549],
+                                 [0.369, 0.788, 0.384],
+                                 [0.993, 0.906, 0.144]]),
+             "coolwarm":np.array([[0.230, 0.299, 0.754],
+                                  [0.554, 0.690, 0.996],
+                                  [0.865, 0.865, 0.865],
+                                  [0.958, 0.604, 0.484],
+                                  [0.706, 0.016, 0.150]]),
+             "gray":np.array([[0.1, 0.1, 0.1],
+                              [0.9, 0.9, 0.9]])}
+for name in list(colorMaps):
+    colorMaps[name+"-r"] = colorMaps[name][::-1]
+
+# 11.2: A normal at each point, the average of the normals of the triangles around it. 
+#       The cross product of two edges is bigger for bigger triangles, so they count more
+def surfaceNormals(points,tris):
+    p0 = points[tris[:,0]]
+    fnorm = np.cross(points[tris[:,1]]-p0, points[tris[:,2]]-p0)
+    del p0
+    normals = np.empty_like(points)
+    for i in range(0,3):
+        normals[:,i] = np.bincount(tris.ravel(), weights=np.repeat(fnorm[:,i],3), minlength=len(points))
+    length = np.linalg.norm(normals, axis=1)
+    length[length == 0.0] = 1.0
+    normals /= length[:,None]
+    return normals
+
+# 11.3: A normal for each triangle, used by STL. Same cross product as above, but made unit length
+def faceNormals(points,tris):
+    p0 = points[tris[:,0]]
+    fnorm = np.cross(points[tris[:,1]]-p0, points[tris[:,2]]-p0)
+    length = np.linalg.norm(fnorm, axis=1)
+    length[length == 0.0] = 1.0
+    fnorm /= length[:,None]
+    return fnorm
+
+# 11.4: Turn result values into an RGB color (0 to 1) at each point with one of the colorMaps. 
+#       By default the range is the min and max of the values
+def valuesToColors(vals,vmin=None,vmax=None,cmap="rainbow"):
+    good = np.isfinite(vals)
+    if vmin is None:
+        vmin = np.min(vals[good]) if np.any(good) else 0.0
+    if vmax is None:
+        vmax = np.max(vals[good]) if np.any(good) else 1.0
+    if vmax > vmin:
+        frac = np.clip((np.nan_to_num(vals)-vmin)/(vmax-vmin), 0.0, 1.0)
+    else:
+        frac = np.zeros(len(vals))
+    cmapColors = colorMaps[cmap]
+    stops = np.linspace(0.0, 1.0, len(cmapColors))
+    colors = np.empty((len(vals),3))
+    for i in range(0,3):
+        colors[:,i] = np.interp(frac, stops, cmapColors[:,i])
+    colors[~good] = nanColor
+    return colors
+
+# 11.5: Write arrays to a text file with one line per row. Python's % formatting can do a whole 
+#       block of rows in one go, so repeat the line format for a block of rows and write it all at once. 
+#       If there is more than one array, their columns go side by side on the line. 
+#       The block size comes from chunkRows() (Section 14) so big files don't need big copies
+def writeRows(fh,fmt,*arrs):
+    ncol = sum(np.asarray(a).shape[1] for a in arrs)
+    step = chunkRows(ncol*40)
+    for i in range(0, len(arrs[0]), step):
+        blk = np.hstack([np.asarray(a[i:i+step]) for a in arrs])
+        fh.write((fmt*len(blk)) % tuple(blk.ravel().tolist()))
+
+# 11.6: Wavefront OBJ. Vertex colors go on the end of the "v" lines (MeshLab, Blender, and most 
+#       viewers read these), then the normals and the faces. OBJ counts from 1, not 0
+def writeObj(fname,points,tris,normals,colors):
+    with open(fname,"w") as fh:
+        fh.write("# PADT Ansys Result to 3D Files\n")
+        fh.write("# %d vertices, %d faces\n" % (len(points), len(tris)))
+        writeRows(fh,"v %.7g %.7g %.7g %.4f %.4f %.4f\n",points,colors)
+        writeRows(fh,"vn %.4f %.4f %.4f\n",normals)
+        step = chunkRows(6*8)
+        for i in range(0, len(tris), step):
+            writeRows(fh,"f %d//%d %d//%d %d//%d\n",np.repeat(tris[i:i+step]+1,2,axis=1))
+
+# 11.7: ASCII STL. Each triangle is a facet with its normal and three vertices. 
+#       All 12 numbers for a facet go in one row so the whole facet is one line format
+def writeStl(fname,points,tris):
+    with open(fname,"w") as fh:
+        fh.write("solid ansys_result\n")
+        step = chunkRows(12*8)
+        for i in range(0, len(tris), step):
+            tri = tris[i:i+step]
+            writeRows(fh,"facet normal %.6e %.6e %.6e\n outer loop\n  vertex %.7e %.7e %.7e\n"
+                         "  vertex %.7e %.7e %.7e\n  vertex %.7e %.7e %.7e\n endloop\nendfacet\n", 
+                      faceNormals(points,tri), points[tri[:,0]], points[tri[:,1]], points[tri[:,2]])
+        fh.write("endsolid ansys_result\n")
+
+# 11.8: VRML 2.0. One shape with an IndexedFaceSet that has a color and normal at every vertex. 
+#       Each face in coordIndex ends with a -1
+def writeWrl(fname,points,tris,normals,colors):
+    with open(fname,"w") as fh:
+        fh.write("#VRML V2.0 utf8\n")
+        fh.write("# PADT Ansys Result to 3D Files\n")
+        fh.write("Shape {\n  appearance Appearance { material Material { } }\n")
+        fh.write("  geometry IndexedFaceSet {\n    solid FALSE\n")
+        fh.write("    colorPerVertex TRUE\n    normalPerVertex TRUE\n")
+        fh.write("    coord Coordinate { point [\n")
+        writeRows(fh,"%.7g %.7g %.7g,\n",points)
+        fh.write("    ] }\n    normal Normal { vector [\n")
+        writeRows(fh,"%.4f %.4f %.4f,\n",normals)
+        fh.write("    ] }\n    color Color { color [\n")
+        writeRows(fh,"%.4f %.4f %.4f,\n",colors)
+        fh.write("    ] }\n    coordIndex [\n")
+        writeRows(fh,"%d, %d, %d, -1,\n",tris)
+        fh.write("    ]\n  }\n}\n")
+
+# 11.9: Legacy VTK with more than one result in it, for the "all" result type. 
+#       The cells come from the DPF grid and the points are the distorted coordinates. 
+#       arrays has a (values, location) pair for each result name, and each one becomes a 
+#       point array (nodal) or a cell array (elemental)
+def writeVtkArrays(fname,grid,points,arrays):
+    loadAnsys()
+    out = pv.UnstructuredGrid(grid.cells, grid.celltypes, np.asarray(points, dtype=np.float64))
+    for name in arrays:
+        vals, location = arrays[name]
+        if location == dpf.locations.nodal:
+            out.point_data[name] = vals
+        else:
+            out.cell_data[name] = vals
+    out.save(fname, binary=True)
+#
+# End of Section 11
+
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#
+#  ##### SECTION 12 #####
+#
+#  The outside surface. STL, OBJ, and WRL files only show the outside skin of the model, and for a 
+#    solid model that is a small part of the nodes and elements. Finding the outside faces takes a 
+#    while, but it only depends on the mesh, so we do it once and keep it in the solution cache. 
+#    Then for each new set or scale factor we only distort the nodes on the surface and pick up their 
+#    result values.
+#
+#    The surface is kept as:
+#      tris     - three surface point numbers for each triangle
+#      nodemap  - the mesh node index for each surface point
+#      surfidx  - the surface point for each mesh node, -1 if it is not on the surface
+#
+# 12.1: Pull the outside surface off the undistorted mesh as triangles. 
+#       nonlinear_subdivision=0 keeps just the corner nodes of quadratic elements
+#       The algorithm is named so a new pyvista default does not change the surface. 
+#       Versions of pyvista before the algorithm keyword only have this one
+def buildSurface(mymesh):
+    try:
+        surf = mymesh.grid.extract_surface(pass_pointid=True, pass_cellid=False, nonlinear_subdivision=0, 
+                                           algorithm="dataset_surface")
+    except TypeError:
+        surf = mymesh.grid.extract_surface(pass_pointid=True, pass_cellid=False, nonlinear_subdivision=0)
+    surf = surf.triangulate()
+    tris = np.asarray(surf.faces).reshape(-1,4)[:,1:].astype(np.int64)
+    nodemap = np.asarray(surf.point_data["vtkOriginalPointIds"], dtype=np.int64)
+    surfidx = np.full(mymesh.nodes.n_nodes, -1, dtype=np.int64)
+    surfidx[nodemap] = np.arange(len(nodemap))
+    return {"tris":tris, "nodemap":nodemap, "surfidx":surfidx}
+
+# 12.2: Get the surface and the undistorted nodal coordinates for a cache entry. 
+#       Both are worked out the first time they are asked for, then come from the cache
+def cachedSurface(cached):
+    return solCache.derived(cached,"surface",lambda: buildSurface(cached["mesh"]))
+
+def cachedCoords(cached):
+    def makeIt():
+        data = cached["mesh"].nodes.coordinates_field.data
+        coords = workArray(np.shape(data))
+        coords[:] = data
+        return {"coords":coords}
+    return solCache.derived(cached,"coords",makeIt)["coords"]
+
+# 12.3: The distorted points of the surface and its triangles. 
+#       Only the surface nodes are moved: surface coordinates + scale factor * surface displacements. 
+#       distortInPlace() (Section 14) skips the displacements of nodes that are not on the surface
+def surfacePoints(cached,usumval,sclfact):
+    surf = cachedSurface(cached)
+    coords = cachedCoords(cached)
+    points = coords[surf["nodemap"]]
+    if usumval is not None:
+        distortInPlace(points,coords,usumval,cached,sclfact,surf["surfidx"])
+    return points, surf["tris"]
+
+# 12.4: The distorted surface plus a result value at each surface point. Vector results use the 
+#       length of the vector. Elemental results are averaged to the nodes from all of the elements 
+#       around each node, inside the model too, by elementalToNodal() (Section 21). 
+#       Points with no result stay NaN, and come out gray
+def surfaceArrays(cached,usumval,sclfact,rstval):
+    points, tris = surfacePoints(cached,usumval,sclfact)
+    surf = cachedSurface(cached)
+
+    vals, location = gatherField(rstval,cached)
+    if vals.ndim > 1:
+        vals = np.linalg.norm(vals, axis=1)
+
+    if location == dpf.locations.nodal:
+        vvals = vals[surf["nodemap"]]
+    else:
+        vvals = elementalToNodal(vals,cached)[surf["nodemap"]]
+    return points, tris, vvals
+#
+# End of Section 12
+
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#
+#  ##### SECTION 13 #####
+#
+#  Binary files. Text STL and OBJ files are big and slow to write and read, because every number 
+#    gets turned into text. For 3D printing and web viewers we can write binary STL and GLB 
+#    (binary glTF) instead. Everything is put in little-endian numpy arrays that are written to 
+#    the file in one go.
+#
+# 13.1: Binary STL. An 80 byte header, the number of triangles, then 50 bytes per triangle: 
+#       the normal, the three vertices (all 32 bit floats), and a 2 byte attribute we leave at zero
+stlDtype = np.dtype([("normal","<f4",(3,)), ("verts","<f4",(3,3)), ("attr","<u2")])
+
+#       The facets are built and written a block at a time (chunkRows(), Section 14)
+def writeStlBinary(fname,points,tris):
+    with open(fname,"wb") as fh:
+        fh.write(b"PADT Ansys Result to 3D Files".ljust(80,b" "))
+        fh.write(np.array([len(tris)], dtype="<u4").tobytes())
+        step = chunkRows(stlDtype.itemsize*4)
+        for i in range(0, len(tris), step):
+            tri = tris[i:i+step]
+            facets = np.zeros(len(tri), dtype=stlDtype)
+            facets["normal"] = faceNormals(points,tri)
+            facets["verts"] = points[tri]
+            facets.tofile(fh)
+
+# 13.2: GLB. A GLB file is a 12 byte header, a JSON chunk that describes the mesh, and a binary 
+#       chunk with the data. The binary chunk has one block (buffer view) for each of the 
+#       positions, normals, colors, and triangle indices, each starting on a 4 byte boundary. 
+#       Colors are always 8 bit RGBA, and the indices are 16 bit if there are few enough points. 
+#
+#       With quantize=True the positions are stored as 16 bit integers from 0 at the minimum to 
+#       65535 at the maximum of each direction, and the normals as 8 bit integers. The node gets a 
+#       scale and translation that turns them back into the real positions. This needs the 
+#       KHR_mesh_quantization extension, which three.js, Babylon.js, and Blender all read. 
+#       glTF has no 16 bit float type, so integers are the way to make the buffers smaller
+#
+#       The sizes of the blocks are known up front, so each block is converted and written 
+#       a piece at a time (chunkRows(), Section 14) instead of all at once
+def writeGlb(fname,points,tris,normals,colors,quantize=False):
+    pmin = np.min(points, axis=0).astype(np.float64)
+    pmax = np.max(points, axis=0).astype(np.float64)
+    npts = len(points)
+
+# 13.2.1: Positions and normals, as 32 bit floats or quantized. 
+#         Each block has a function that makes the bytes for rows i to j
+    node = {"mesh":0}
+    if quantize:
+        span = np.where(pmax > pmin, pmax-pmin, 1.0)
+        def posRows(i,j):
+            buf = np.zeros((len(points[i:j]),4), dtype="<u2")
+            buf[:,:3] = np.rint((points[i:j]-pmin)/span*65535.0)
+            return buf
+        def nrmRows(i,j):
+            buf = np.zeros((len(normals[i:j]),4), dtype="<i1")
+            buf[:,:3] = np.rint(np.clip(normals[i:j],-1.0,1.0)*127.0)
+            return buf
+        posAcc = {"componentType":5123, "type":"VEC3", "min":[0,0,0], 
+                  "max":[int(v) for v in np.rint((pmax-pmin)/span*65535.0)]}
+        posStride = 8
+        nrmAcc = {"componentType":5120, "type":"VEC3", "normalized":True}
+        nrmStride = 4
+        node["translation"] = [float(v) for v in pmin]
+        node["scale"] = [float(v) for v in span/65535.0]
+    else:
+        def posRows(i,j):
+            return np.asarray(points[i:j], dtype="<f4")
+        def nrmRows(i,j):
+            return np.asarray(normals[i:j], dtype="<f4")
+        posAcc = {"componentType":5126, "type":"VEC3", 
+                  "min":[float(v) for v in pmin.astype("<f4")], "max":[float(v) for v in pmax.astype("<f4")]}
+        posStride = 12
+        nrmAcc = {"componentType":5126, "type":"VEC3"}
+        nrmStride = 12
+
+# 13.2.2: Colors as 8 bit RGBA and the triangle indices
+    def colRows(i,j):
+        buf = np.full((len(colors[i:j]),4), 255, dtype="u1")
+        buf[:,:3] = np.rint(np.clip(colors[i:j],0.0,1.0)*255.0)
+        return buf
+    colAcc = {"componentType":5121, "type":"VEC4", "normalized":True}
+    if npts < 65535:
+        idxType = "<u2"
+        idxAcc = {"componentType":5123, "type":"SCALAR"}
+    else:
+        idxType = "<u4"
+        idxAcc = {"componentType":5125, "type":"SCALAR"}
+    def idxRows(i,j):
+        return np.asarray(tris[i:j], dtype=idxType)
+
+# 13.2.3: Lay the blocks out one after the other, padded to 4 bytes, and build the JSON that 
+#         points at them. Each block: rows, bytes per row, values per row, row function, accessor, 
+#         stride, and target (34962 for vertex data, 34963 for indices)
+    blocks = [(npts, posStride, 1, posRows, posAcc, posStride, 34962), 
+              (npts, nrmStride, 1, nrmRows, nrmAcc, nrmStride, 34962), 
+              (npts, 4, 1, colRows, colAcc, 4, 34962), 
+              (len(tris), 3*np.dtype(idxType).itemsize, 3, idxRows, idxAcc, None, 34963)]
+    views = []
+    accessors = []
+    offset = 0
+    for nrow, rowBytes, perRow, rowFn, acc, stride, target in blocks:
+        nbytes = nrow*rowBytes
+        view = {"buffer":0, "byteOffset":offset, "byteLength":nbytes, "target":target}
+        if stride is not None:
+            view["byteStride"] = stride
+        views.append(view)
+        acc = dict(acc)
+        acc["bufferView"] = len(views)-1
+        acc["count"] = nrow*perRow
+        accessors.append(acc)
+        offset += (nbytes + 3)//4*4
+    binLength = offset
+
+    gltf = {
+        "asset":{"version":"2.0", "generator":"PADT Ansys Result to 3D Files"},
+        "scene":0, "scenes":[{"nodes":[0]}], "nodes":[node],
+        "meshes":[{"primitives":[{"attributes":{"POSITION":0, "NORMAL":1, "COLOR_0":2}, 
+                                  "indices":3, "mode":4}]}],
+        "buffers":[{"byteLength":binLength}],
+        "bufferViews":views, "accessors":accessors,
+    }
+    if quantize:
+        gltf["extensionsUsed"] = ["KHR_mesh_quantization"]
+        gltf["extensionsRequired"] = ["KHR_mesh_quantization"]
+    jsonBytes = json.dumps(gltf, separators=(",",":")).encode("utf-8")
+    jsonBytes += b" "*((4 - len(jsonBytes)%4) % 4)
+
+# 13.2.4: Write the header, the JSON chunk, and the binary chunk a block at a time
+    total = 12 + 8 + len(jsonBytes) + 8 + binLength
+    with open(fname,"wb") as fh:
+        fh.write(np.array([0x46546C67, 2, total], dtype="<u4").tobytes())
+        fh.write(np.array([len(jsonBytes), 0x4E4F534A], dtype="<u4").tobytes())
+        fh.write(jsonBytes)
+        fh.write(np.array([binLength, 0x004E4942], dtype="<u4").tobytes())
+        for nrow, rowBytes, perRow, rowFn, acc, stride, target in blocks:
+            step = chunkRows(rowBytes*4)
+            for i in range(0, nrow, step):
+                fh.write(rowFn(i,i+step).tobytes())
+            fh.write(b"\0"*((4 - (nrow*rowBytes)%4) % 4))
+#
+# End of Section 13
+
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#
+#  ##### SECTION 14 #####
+#
+#  Keeping the memory down on very big models. A 20 million node model has 480 MB of nodal 
+#    coordinates, and making a copy of the mesh, a scaled displacement field, and a sum of the two 
+#    quickly runs out of memory. So instead:
+#    - The distortion is done in place on one coordinate array. The displacements are added to it 
+#      a field and a block of nodes at a time, so there is never a full displacement array
+#    - The writers build and write their output a block of rows at a time
+#    - If a memory cap is given (exportOptions["memCapMB"]), the blocks are sized to fit in it, 
+#      and any big work array is memory mapped to a scratch file instead of held in RAM
+#
+# 14.1: How many rows to do at a time, given roughly how many bytes each row needs. 
+#       With no cap we use big blocks, with a cap each block gets 1/16 of it
+def chunkRows(bytesPerRow):
+    cap = exportOptions["memCapMB"]
+    if cap is None:
+        return 262144
+    return int(max(4096, cap*1024*1024/16/max(bytesPerRow,1)))
+
+# 14.2: Make an array to work in. If there is a cap and the array would use more than a quarter 
+#       of it, put it in a scratch file on disk (exportOptions["scratchDir"], or the temp folder). 
+#       The file has no name and goes away when the array does
+def workArray(shape,dtype=np.float64):
+    nbytes = int(np.prod(shape))*np.dtype(dtype).itemsize
+    cap = exportOptions["memCapMB"]
+    if cap is not None and nbytes > cap*1024*1024/4:
+        scratch = tempfile.TemporaryFile(prefix="ansys3d-", dir=exportOptions["scratchDir"])
+        return np.memmap(scratch, dtype=dtype, mode="w+", shape=shape)
+    return np.empty(shape, dtype=dtype)
+
+# 14.3: Distort coordinates in place. buf is an array of points that starts out as the undistorted 
+#       coordinates, and coords are the undistorted coordinates of the whole mesh. 
+#       For each displacement field, a block of nodes at a time: find the mesh node index from the 
+#       node ID, then set buf = coords + scale factor * displacement for those nodes. 
+#       If buf is just the surface points, remap gives the surface point for each mesh node (-1 if 
+#       the node is not on the surface). 
+#       Setting the value (instead of adding to it) means nodes shared by two bodies only move once
+def distortInPlace(buf,coords,usumval,cached,sclfact,remap=None):
+    idx, count = idIndex(cached,dpf.locations.nodal)
+    for field in usumval:
+        ids = np.asarray(field.scoping.ids, dtype=np.int64)
+        data = np.asarray(field.data)
+        step = chunkRows(8*8)
+        for i in range(0, len(ids), step):
+            cid = ids[i:i+step]
+            node = lookupIds(idx,cid)
+            if remap is None:
+                row = node
+            else:
+                row = np.where(node >= 0, remap[np.maximum(node,0)], -1)
+            use = row >= 0
+            buf[row[use]] = coords[node[use]] + sclfact*np.nan_to_num(data[i:i+step][use])
+#
+# End of Section 14
+
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#
+#  ##### SECTION 15 #####
+#
+#  Stage timing and memory. The text zone tells the user what is going on, but not where the 
+#    time went, so a slow translation was hard to figure out after the fact. So createResultFile() 
+#    runs its steps as stages of a StageMetrics object: load (5.5), extract (5.6 and 5.7), 
+#    distort (5.8 to 5.10), plot (5.11), and export (5.12)
+#    - Each stage records the wall clock time, the CPU time, the peak memory (RSS) during the 
+#      stage, the peak of the process so far, and the size of the big arrays made in it
+#    - The records stay in the object, so the text zone and the batch summary can both show them
+#    - If exportOptions["metricsLog"] has a file name, each record is also added to that file 
+#      as one line of JSON, with the job it came from
+#
+# 15.1: The peak memory (RSS) of this process so far in MB. The resource module is only on Linux 
+#       and Mac, and it gives KB on Linux and bytes on Mac. On Windows we use psutil if it is 
+#       installed. None if we can't tell
+def peakRssMB():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            return peak/1024/1024
+        return peak/1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info,"peak_wset",info.rss)/1024/1024
+    except ImportError:
+        return None
+
+# 15.1.1: The peak memory of one stage. The peak above is for the whole life of the process, so 
+#         after one big stage every stage shows the same number. On Linux the kernel can reset 
+#         the peak (writing 5 to /proc/self/clear_refs), and VmHWM in /proc/self/status is then 
+#         the peak since the reset. resetPeakRss() says if that worked, and stagePeakRssMB() is 
+#         None if we can't tell. The reset also lowers what peakRssMB() gives on Linux, so the 
+#         peak of the process is kept in processPeak as the biggest of everything we have seen
+processPeak = {"MB":None}
+
+def resetPeakRss():
+    try:
+        with open("/proc/self/clear_refs","w") as fh:
+            fh.write("5")
+        return True
+    except OSError:
+        return False
+
+def stagePeakRssMB():
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])/1024
+    except (OSError,ValueError):
+        pass
+    return None
+
+def processPeakRssMB(stagePeak):
+    peaks = [pk for pk in (processPeak["MB"], peakRssMB(), stagePeak) if pk is not None]
+    if len(peaks) > 0:
+        processPeak["MB"] = max(peaks)
+    return processPeak["MB"]
+
+class StageMetrics:
+
+# 15.2: job is a dictionary that says what is being translated (file, set, result and output type). 
+#       It goes on every line of the log so the lines can be told apart
+    def __init__(self,job=None):
+        self.job = dict(job or {})
+        self.records = []
+        self.current = None
+
+# 15.3: Time one stage:   with metrics.stage("load") as stg: 
+#       stg is the record, so the step can add to it or set stg["ok"] = False if it failed. 
+#       The record is kept even if the stage raises an error or gets cancelled. 
+#       The process peak is noted before the reset so it is not lost (15.1.1)
+    @contextmanager
+    def stage(self,name):
+        rec = {"stage":name, "ok":True, "arrays":{}}
+        self.current = rec
+        processPeakRssMB(None)
+        canReset = resetPeakRss()
+        cpu0 = time.process_time()
+        wall0 = time.perf_counter()
+        try:
+            yield rec
+        except BaseException:
+            rec["ok"] = False
+            raise
+        finally:
+            rec["wallSecs"] = time.perf_counter() - wall0
+            rec["cpuSecs"] = time.process_time() - cpu0
+            rec["peakRssMB"] = stagePeakRssMB() if canReset else None
+            rec["processPeakRssMB"] = processPeakRssMB(rec["peakRssMB"])
+            self.current = None
+            self.records.append(rec)
+            writeMetrics(self.job,rec)
+
+# 15.4: Note the size in bytes of the arrays made in the current stage. 
+#       Takes numpy arrays or a number of bytes. Fields containers add up the data of every field
+    def addArray(self,name,arr):
+        if self.current is None or arr is None:
+            return
+        if hasattr(arr,"nbytes"):
+            self.current["arrays"][name] = int(arr.nbytes)
+        else:
+            self.current["arrays"][name] = int(arr)
+
+    def addArrays(self,**arrs):
+        for name in arrs:
+            self.addArray(name,arrs[name])
+
+    def addFields(self,name,fc):
+        self.addArray(name,sum(np.asarray(field.data).nbytes for field in fc))
+
+# 15.5: The stage with this name (the last one if it ran more than once), or None
+    def get(self,name):
+        for rec in reversed(self.records):
+            if rec["stage"] == name:
+                return rec
+        return None
+
+# 15.6: One line of text per stage, for the text zone
+    def summaryLines(self):
+        return [stageLine(rec["stage"], 1, rec["wallSecs"], rec["wallSecs"], rec["cpuSecs"], 
+                          sum(rec["arrays"].values()), rec["peakRssMB"]) for rec in self.records]
+#
+# End of StageMetrics
+
+# 15.7: The last StageMetrics made by createResultFile(), so the GUI can look at it after a job
+lastMetrics = None
+metricsLock = threading.Lock()
+
+# 15.8: Add a record to the metrics log. The GUI worker and the batch workers can all be adding 
+#       lines, so write each one with a single call while holding the lock
+def writeMetrics(job,rec):
+    logName = exportOptions["metricsLog"]
+    if logName is None:
+        return
+    line = dict(job)
+    line.update(rec)
+    line["pid"] = os.getpid()
+    line["time"] = time.time()
+    with metricsLock:
+        with open(logName,"a") as fh:
+            fh.write(json.dumps(line, default=str) + "\n")
+
+# 15.9: A table of stage times for many jobs, used by the batch summary. Stages are listed in the 
+#       order they first show up, with the total and biggest time and the biggest memory use
+def stageTable(recordLists):
+    totals = OrderedDict()
+    for records in recordLists:
+        for rec in records:
+            tot = totals.setdefault(rec["stage"], {"count":0, "wall":0.0, "wallMax":0.0, "cpu":0.0, 
+                                                    "arrays":0, "peakRss":None})
+            tot["count"] += 1
+            tot["wall"] += rec["wallSecs"]
+            tot["wallMax"] = max(tot["wallMax"], rec["wallSecs"])
+            tot["cpu"] += rec["cpuSecs"]
+            tot["arrays"] = max(tot["arrays"], sum(rec["arrays"].values()))
+            if rec["peakRssMB"] is not None:
+                tot["peakRss"] = max(tot["peakRss"] or 0.0, rec["peakRssMB"])
+    return [stageLine(name, tot["count"], tot["wall"], tot["wallMax"], tot["cpu"], tot["arrays"], 
+                      tot["peakRss"]) for name, tot in totals.items()]
+
+def stageLine(name,count,wall,wallMax,cpu,arrays,peakRss):
+    if peakRss is None:
+        rss = "     n/a"
+    else:
+        rss = "%8.1f" % peakRss
+    return "  %-8s x%-4d wall %8.3fs (max %7.3fs)  cpu %8.3fs  arrays %8.1f MB  peak RSS %s MB" % (
+        name, count, wall, wallMax, cpu, arrays/1024/1024, rss)
+#
+# End of Section 15
+
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#
+#  ##### SECTION 16 #####
+#
+#  Loading DPF and the DPF server. Importing the DPF modules and pyvista takes a few seconds, 
+#    and so does starting a DPF server. For short batch jobs that was most of the time. So:
+#    - Nothing from DPF or pyvista is imported until the first time it is needed
+#    - One DPF server is started (or connected to) and every translation uses it, until 
+#      the window is closed or the batch is done. Each batch worker process has its own
+#    - How long the imports and the server start took is kept in dpfState and reported
+#
+# 16.1: The state of the server, with a lock so the GUI worker and the warm up thread 
+#       don't both start one
+dpfLock = threading.RLock()
+dpfState = {"server":None, "address":None, "importSecs":None, "serverSecs":None}
+
+# 16.2: Import DPF and pyvista into the globals from Section 1
+def loadAnsys():
+    global post, dpf, coreops, pv
+    if dpf is not None:
+        return
+    with dpfLock:
+        if dpf is not None:
+            return
+        start = time.perf_counter()
+        from ansys.dpf import post as dpfPost
+        from ansys.dpf import core as dpfCore
+        from ansys.dpf.core import operators as dpfOps
+        import pyvista as pyv
+        post, coreops, pv = dpfPost, dpfOps, pyv
+        dpf = dpfCore
+        dpfState["importSecs"] = time.perf_counter() - start
+
+# 16.3: Start the DPF server, or connect to the one in exportOptions["dpfServer"] (host:port). 
+#       It is made the global server, so load_solution() and every operator uses it. 
+#       Only the first call does anything, the rest just return the server
+def startDpf():
+    loadAnsys()
+    with dpfLock:
+        if dpfState["server"] is not None:
+            return dpfState["server"]
+        start = time.perf_counter()
+        address = exportOptions["dpfServer"]
+        if address is None:
+            server = dpf.start_local_server(as_global=True)
+            address = "local"
+        else:
+            host, port = address.rsplit(":",1)
+            server = dpf.connect_to_server(ip=host, port=int(port), as_global=True)
+        dpfState["server"] = server
+        dpfState["address"] = address
+        dpfState["serverSecs"] = time.perf_counter() - start
+        tzPrint(textZone,"DPF server (" + address + ") ready in %.2f s, imports took %.2f s" % 
+                (dpfState["serverSecs"], dpfState["importSecs"]))
+        return server
+
+# 16.4: Shut down the server if we started it. A server we connected to is left running. 
+#       The cached solutions belong to the server, so they go too
+def stopDpf():
+    with dpfLock:
+        server = dpfState["server"]
+        if server is None:
+            return
+        solCache.clear()
+        dpfState["server"] = None
+        if dpfState["address"] == "local":
+            try:
+                server.shutdown()
+            except Exception:
+                pass
+
+# 16.5: The GUI starts the server on a background thread as soon as the window is up, so it is 
+#       usually ready by the time the user has filled everything out. If it fails, the first 
+#       translation will try again and report the error
+def warmDpf():
+    try:
+        startDpf()
+    except Exception as exc:
+        tzPrint(textZone,"Could not start DPF yet: " + type(exc).__name__ + ": " + str(exc))
+#
+# End of Section 16
+
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#
+#  ##### SECTION 17 #####
+#
+#  Level of detail (LOD). The surface files come out with every triangle the solver mesh has, 
+#    which can be hundreds of MB, and a web viewer or a customer does not need that. So the 
+#    OBJ, WRL, STL, STLB, and GLB files can also be written as one or more lighter versions. 
+#
+#    This uses vertex clustering: put a grid of cubes over the model, merge all of the surface 
+#    points in each cube into one point, and throw out the triangles that collapse. Everything is 
+#    done with numpy on whole arrays, and only on the surface, so it is fast and the memory is a 
+#    few arrays the size of the surface. 
+#    - Which points merge only depends on the undistorted surface and the cube size, so it is 
+#      worked out once for each level and kept in the solution cache (Section 7)
+#    - The merged point is the average of the distorted points, and its result value is the 
+#      average of their values, so each set only costs a few bincounts
+#
+#    A level is given as a number of triangles ("200000", "50k") or as a cube size in percent of 
+#    the model size ("0.5%"). "full" is the surface with nothing taken out
+#
+# 17.1: Turn a string like "full,200k,0.5%" into a list of levels. Counts are stored as whole 
+#       numbers and sizes keep their % sign
+def parseLodList(theStr):
+    levels = []
+    for item in theStr.split(","):
+        item = item.strip().lower()
+        if len(item) == 0:
+            continue
+        try:
+            if item == "full":
+                level = "full"
+            elif item.endswith("%"):
+                level = "%g%%" % float(item[:-1])
+                if float(item[:-1]) <= 0.0:
+                    raise ValueError()
+            else:
+                mult = {"k":1000, "m":1000000}.get(item[-1], 1)
+                level = str(int(float(item.rstrip("km"))*mult))
+                if int(level) < 4:
+                    raise ValueError()
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                "Bad LOD level: " + item + " (use full, a triangle count like 50k, or a size like 0.5%)"
+            )
+        if level not in levels:
+            levels.append(level)
+    return levels
+
+# 17.2: Merge the points that are in the same cube. Returns the merged point number for each 
+#       surface point (-1 if it is not used any more) and the triangles that are left, 
+#       in merged point numbers. Triangles that end up with the same three points twice 
+#       (like the two sides of a thin wall) are only kept once
+def clusterSurface(points,tris,cell):
+    ijk = np.floor((points-points.min(axis=0))/cell).astype(np.int64)
+    dims = ijk.max(axis=0) + 1
+    key = (ijk[:,0]*dims[1] + ijk[:,1])*dims[2] + ijk[:,2]
+    del ijk
+    ukey, cluster = np.unique(key, return_inverse=True)
+    cluster = cluster.reshape(-1)
+
+    ctris = cluster[tris]
+    keep = (ctris[:,0] != ctris[:,1]) & (ctris[:,1] != ctris[:,2]) & (ctris[:,0] != ctris[:,2])
+    ctris = ctris[keep]
+    srt = np.sort(ctris, axis=1)
+    order = np.lexsort((srt[:,2], srt[:,1], srt[:,0]))
+    srt = srt[order]
+    first = np.ones(len(srt), dtype=bool)
+    first[1:] = np.any(srt[1:] != srt[:-1], axis=1)
+    ctris = ctris[np.sort(order[first])]
+
+    used = np.zeros(len(ukey), dtype=bool)
+    used[ctris.ravel()] = True
+    renum = np.full(len(ukey), -1, dtype=np.int64)
+    renum[used] = np.arange(np.count_nonzero(used))
+    return renum[cluster], renum[ctris]
+
+# 17.3: The merged points and triangles for a level, from the cache if we already did it. 
+#       For a triangle count, start from the cube size that would give about that many triangles 
+#       on a surface with this area, then change it a few times until we are within 10%
+def lodCluster(cached,level):
+    def makeIt():
+        surf = cachedSurface(cached)
+        points = cachedCoords(cached)[surf["nodemap"]]
+        tris = surf["tris"]
+        size = float(np.max(points.max(axis=0)-points.min(axis=0)))
+        if level.endswith("%"):
+            cell = float(level[:-1])/100.0*max(size,1e-30)
+            cluster, ltris = clusterSurface(points,tris,cell)
+        else:
+            target = int(level)
+            p0 = points[tris[:,0]]
+            area = 0.5*np.sum(np.linalg.norm(np.cross(points[tris[:,1]]-p0, points[tris[:,2]]-p0), axis=1))
+            del p0
+            cell = max(np.sqrt(2.0*area/max(target,1)), size*1e-6)
+            if len(tris) <= target:
+                cluster, ltris, cell = np.arange(len(points)), tris, 0.0
+            for k in range(8 if cell > 0.0 else 0):
+                cluster, ltris = clusterSurface(points,tris,cell)
+                ratio = len(ltris)/float(target)
+                if abs(ratio-1.0) < 0.1:
+                    break
+                cell *= np.sqrt(max(ratio,0.01))
+        return {"cluster":cluster, "tris":ltris, "cell":np.array(cell)}
+    return solCache.derived(cached,"lod-"+level,makeIt)
+
+# 17.4: The lighter surface for a level, from the full distorted surface points and their 
+#       result values (None for STL). Each merged point is the average of the points in it, 
+#       and its value is the average of the values that are not NaN
+def lodSurface(cached,level,points,vvals=None):
+    lod = lodCluster(cached,level)
+    cluster = lod["cluster"]
+    use = cluster >= 0
+    cl = cluster[use]
+    npts = int(cl.max())+1 if len(cl) > 0 else 0
+    count = np.maximum(np.bincount(cl, minlength=npts), 1)
+    lpoints = np.empty((npts,3))
+    for i in range(0,3):
+        lpoints[:,i] = np.bincount(cl, weights=points[use,i], minlength=npts)/count
+    lvals = None
+    if vvals is not None:
+        vv = vvals[use]
+        good = np.isfinite(vv)
+        total = np.bincount(cl, weights=np.where(good,vv,0.0), minlength=npts)
+        ngood = np.bincount(cl, weights=good.astype(np.float64), minlength=npts)
+        lvals = np.full(npts, np.nan)
+        np.divide(total, ngood, out=lvals, where=ngood > 0)
+    return lpoints, lod["tris"], lvals
+#
+# End of Section 17
+
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#
+#  ##### SECTION 18 #####
+#
+#  Manifests. Running a batch again used to write every file again, even when nothing had changed. 
+#    Now each file gets a small JSON file next to it (the file name plus ".manifest.json") with a 
+#    hash of everything that went into it: a fingerprint of the result file, the set, result type, 
+#    percent distortion, file type, level of detail, the options that change the file, and the 
+#    version of this program. If a new run would have the same hash and the file is still there 
+#    with the same size, it is up to date and createResultFile() leaves it alone
+#
+# 18.1: A fingerprint of the result file: its size, modified time, and a hash of the first and 
+#       last MB. Hashing the whole file would take as long as reading it, so this is a sample. 
+#       It is kept for as long as the size and time don't change, so each job doesn't read it again
+fingerprintBytes = 1024*1024
+fingerprints = {}
+fingerprintLock = threading.Lock()
+
+def fileFingerprint(path):
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime_ns)
+    with fingerprintLock:
+        if key in fingerprints:
+            return fingerprints[key]
+    sample = hashlib.sha256()
+    with open(path,"rb") as fh:
+        sample.update(fh.read(fingerprintBytes))
+        if st.st_size > 2*fingerprintBytes:
+            fh.seek(-fingerprintBytes, os.SEEK_END)
+            sample.update(fh.read(fingerprintBytes))
+    fp = {"size":st.st_size, "mtime_ns":st.st_mtime_ns, "sample":sample.hexdigest()}
+    with fingerprintLock:
+        fingerprints[key] = fp
+    return fp
+
+# 18.2: The inputs of one output file and their hash. Options only go in if they change this file: 
+#       quantize only for GLB, the colors only for the files that have them, and the scale options 
+#       only if the mesh is distorted. 
+#       Returns the hash and the inputs, which are written to the manifest so you can see why 
+#       a file was made again
+def outputHash(rstPath,rstnum,pcntdfl,rsttype,outtype,level):
+    params = {"rstnum":rstnum, "pcntdfl":float(pcntdfl), "rsttype":rsttype, "outtype":outtype, "lod":level}
+    if outtype == "glb":
+        params["quantize"] = bool(exportOptions["quantize"])
+    if outtype in ("obj","wrl","glb"):
+        params["colormap"] = exportOptions["colormap"]
+        params["colorRange"] = exportOptions["colorRange"]
+        params["averageBodies"] = bool(exportOptions["averageBodies"])
+    if rsttype != "tmp":
+        params["scaleMode"] = exportOptions["scaleMode"]
+        if exportOptions["scaleMode"] == "global":
+            params["scaleSets"] = exportOptions["scaleSets"]
+        params["fixedUmax"] = exportOptions["fixedUmax"]
+    inputs = {"version":toolVersion, "fingerprint":fileFingerprint(rstPath), "params":params}
+    digest = hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+    inputs["rstFile"] = os.path.abspath(rstPath)
+    return digest, inputs
+
+# 18.3: The manifest that goes with a file, and a check if the file is up to date
+def manifestName(fname):
+    return fname + ".manifest.json"
+
+def upToDate(fname,digest):
+    try:
+        with open(manifestName(fname)) as fh:
+            man = json.load(fh)
+        return man["inputHash"] == digest and os.path.getsize(fname) == man["bytes"]
+    except (OSError, ValueError, KeyError):
+        return False
+
+# 18.4: Write the manifest after the file is done. It goes to a temporary name first and is then 
+#       renamed, so a run that gets stopped never leaves half a manifest
+def writeManifest(fname,digest,inputs):
+    man = {"tool":"Ansys_3D_Result_Translator", "file":os.path.basename(fname), 
+           "bytes":os.path.getsize(fname), "created":time.strftime("%Y-%m-%d %H:%M:%S"), 
+           "inputHash":digest, "inputs":inputs}
+    tmpName = manifestName(fname) + ".tmp"
+    with open(tmpName,"w") as fh:
+        json.dump(man, fh, indent=1, default=str)
+    os.replace(tmpName, manifestName(fname))
+
+# 18.5: How many files the jobs with these stage records really wrote. The manifest stage only 
+#       knows how many it planned to write, the export stage has the ones that worked (5.12.6)
+def filesMade(records):
+    return sum(len(rec.get("files",{})) for rec in records if rec["stage"] == "export")
+
+# 18.6: Check the manifests of the files one createResultFile() call would make, without loading 
+#       the result file. Same names (outputFiles(), Section 20) and the same hash as 5.4.2. 
+#       Returns how many are up to date and how many there are
+def filesUpToDate(rstPath,rstnum,pcntdfl,rsttype,outtypes,outroot):
+    outFiles = outputFiles(os.path.join(os.path.dirname(rstPath),outroot+"-"+rsttype+"-"+str(rstnum)),
+                           outtypes,exportOptions["lod"])
+    current = 0
+    for ot, level, fname in outFiles.values():
+        if not exportOptions["force"] and upToDate(fname,outputHash(rstPath,rstnum,pcntdfl,rsttype,ot,level)[0]):
+            current += 1
+    return current, len(outFiles)
+#
+# End of Section 18
+
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#
+#  ##### SECTION 19 #####
+#
+#  Watching folders. The solver cluster drops result files into shared folders, and someone had to 
+#    open the window and translate each one. In watch mode we look at a list of folders every few 
+#    seconds, and when a result file is done being written we translate it, with no one there. 
+#
+#    Example: 
+#       python Ansys_3D_Result_Translator.py watch //cluster/runs/bracket //cluster/runs/pump --workers 4
+#
+#    - A file is done when its size and modified time have not changed for --settle seconds
+#    - What gets made comes from a recipe: the command line gives the defaults, and a file called 
+#      ansys3d-recipe.json in a folder changes them for that folder, like 
+#         {"sets":"all", "types":"usum,seqv", "formats":"glb,stlb", "lod":"full,50k"}
+#      sets can be a list like "1-5", "all", or "last"
+#    - Each file is one job on a pool of worker processes. Only --max-queue jobs are handed to the 
+#      pool at a time, the rest wait their turn, so a flood of files doesn't pile up in memory
+#    - A job that fails is tried again after a wait that doubles each time, up to --retries times. 
+#      The manifests (Section 18) mean a retry only makes the files that are still missing
+#    - Every --stats-every seconds we print (and write to --stats-file) the queue depth and throughput
+#
+# 19.1: The recipe file name, the result file types we look for, and the recipe settings
+recipeName = "ansys3d-recipe.json"
+rstExts = (".rst",".rth")
+recipeKeys = ("sets","types","formats","pcntdfl","outroot","quantize","lod","scaleMode",
+              "colormap","colorRange","averageBodies")
+
+# 19.2: The recipe for a folder: the defaults with the folder's recipe file on top. 
+#       It is read on every look at the folder, so changes to it are picked up right away. 
+#       The values are checked here so a bad recipe is reported before any job runs
+def loadRecipe(theDir,defaults):
+    recipe = dict(defaults)
+    path = os.path.join(theDir,recipeName)
+    if os.path.isfile(path):
+        with open(path) as fh:
+            mine = json.load(fh)
+        bad = [k for k in mine if k not in recipeKeys]
+        if len(bad) > 0:
+            raise ValueError("Unknown recipe setting(s): " + ", ".join(bad))
+        recipe.update(mine)
+    if recipe["sets"] not in ("all","last"):
+        parseSetList(str(recipe["sets"]))
+    recipe["types"] = parseNameList(str(recipe["types"]),rsttype_list,"result type")
+    recipe["formats"] = parseNameList(str(recipe["formats"]),outtype_list,"output file type")
+    if "all" in recipe["types"] and any(ot not in ("vtk","none") for ot in recipe["formats"]):
+        raise ValueError("The all result type can only be written with formats vtk")
+    recipe["pcntdfl"] = float(recipe["pcntdfl"])
+    lod = recipe["lod"]
+    if isinstance(lod,list) and all(isinstance(lvl,(str,int,float)) for lvl in lod):
+        lod = ",".join(str(lvl) for lvl in lod)
+    if lod is not None and not isinstance(lod,str):
+        raise ValueError("lod has to be a list or a comma separated string of levels")
+    try:
+        recipe["lod"] = (parseLodList(lod) or None) if lod is not None else None
+    except argparse.ArgumentTypeError as exc:
+        raise ValueError(str(exc))
+    if recipe["scaleMode"] not in ("set","global"):
+        raise ValueError("scaleMode has to be set or global")
+    if recipe["colormap"] not in colorMaps:
+        raise ValueError("colormap has to be one of " + ", ".join(sorted(colorMaps)))
+    if recipe["colorRange"] is not None and not isinstance(recipe["colorRange"],tuple):
+        recipe["colorRange"] = parseColorRange(recipe["colorRange"])
+    return recipe
+
+# 19.3: What a worker does for one file: load it, work out the sets, then make every result type 
+#       for every set with createResultFile(). The solution stays in the worker's cache for all of them. 
+#       One bad set does not stop the rest, but the job counts as failed so it gets tried again
+def runWatchJob(job):
+    start = time.perf_counter()
+    recipe = job["recipe"]
+    exportOptions.update({"quantize":bool(recipe["quantize"]), "lod":recipe["lod"], 
+                          "scaleMode":recipe["scaleMode"], "scaleSets":None, "fixedUmax":None,
+                          "colormap":recipe["colormap"], "colorRange":recipe["colorRange"], 
+                          "averageBodies":bool(recipe["averageBodies"])})
+    rstFile = os.path.basename(job["rstPath"])
+    rstDir = os.path.dirname(job["rstPath"])
+    outroot = recipe["outroot"] or os.path.splitext(rstFile)[0]
+    res = {"rstPath":job["rstPath"], "ok":True, "error":"", "sets":0, "made":0, "skipped":0}
+    try:
+
+# 19.3.1: With a list of sets we know every file name up front, so check the manifests first. 
+#         If every file is up to date (like after the watch is started again) the result file 
+#         is never opened. "all" and "last" need the number of sets, so they have to load it
+        if recipe["sets"] not in ("all","last"):
+            sets = parseSetList(str(recipe["sets"]))
+            res["sets"] = len(sets)
+            current = total = 0
+            for rstnum in sets:
+                for rt in recipe["types"]:
+                    counts = filesUpToDate(job["rstPath"],rstnum,recipe["pcntdfl"],rt,recipe["formats"],outroot)
+                    current += counts[0]
+                    total += counts[1]
+            if current == total:
+                res["skipped"] = current
+                res["secs"] = time.perf_counter() - start
+                return res
+        else:
+            nsets = solCache.get(job["rstPath"])["nsets"]
+            if recipe["sets"] == "all":
+                sets = list(range(1,nsets+1))
+            else:
+                sets = [nsets]
+        res["sets"] = len(sets)
+        errors = []
+        for rstnum in sets:
+            for rt in recipe["types"]:
+                metrics = StageMetrics({"rstFile":rstFile, "rstnum":rstnum, "rsttype":rt, 
+                                        "outtype":",".join(recipe["formats"])})
+                try:
+                    if not createResultFile(rstnum,recipe["pcntdfl"],rt,rstFile,rstDir,recipe["formats"],
+                                            outroot,0,metrics):
+                        errors.append("set %d %s: result not found" % (rstnum, rt))
+                except Exception as exc:
+                    errors.append("set %d %s: %s: %s" % (rstnum, rt, type(exc).__name__, str(exc)))
+                res["made"] += filesMade(metrics.records)
+                check = metrics.get("manifest")
+                if check is not None:
+                    res["skipped"] += check["skipped"]
+        if len(errors) > 0:
+            res["ok"] = False
+            res["error"] = "; ".join(errors)
+    except Exception as exc:
+        res["ok"] = False
+        res["error"] = type(exc).__name__ + ": " + str(exc)
+    res["secs"] = time.perf_counter() - start
+    return res
+
+# 19.4: The queue depth and throughput as a dictionary, and as a line for the console
+def watchStats(stats,pending,inflight,workers):
+    elapsed = max(time.perf_counter() - stats["started"], 1e-9)
+    st = dict(stats)
+    st.update({"waiting":len(pending), "inPool":len(inflight), "running":min(len(inflight),workers), 
+               "queueDepth":len(pending)+len(inflight), "elapsedSecs":elapsed, 
+               "filesPerHour":stats["done"]/elapsed*3600, "filesMadePerHour":stats["made"]/elapsed*3600,
+               "time":time.strftime("%Y-%m-%d %H:%M:%S")})
+    del st["started"]
+    return st
+
+def statsLine(st):
+    return ("[%s] queue %d (waiting %d, in pool %d) | done %d | failed %d | retries %d | "
+            "%.1f result files/h | files made %d, up to date %d" % (st["time"], st["queueDepth"], st["waiting"], 
+            st["inPool"], st["done"], st["failed"], st["retries"], st["filesPerHour"], st["made"], st["skipped"]))
+
+# 19.5: The watch main program. Look at the folders, hand the files that are done to the pool, 
+#       collect what finished, and print the stats, until Ctrl-C (or until everything is done 
+#       with --once). Returns the exit code: 1 if any file failed for good
+def runWatch(argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(sys.argv[0]) + " watch",
+        description="Watch folders and translate Ansys result files as they are written"
+    )
+    parser.add_argument("dirs", nargs="+", help="Folders to watch")
+    parser.add_argument("--sets", default="last", help="Default sets: a list like 1-5, all, or last (default)")
+    parser.add_argument("--types", default="usum", help="Default result types (default usum)")
+    parser.add_argument("--formats", default="vtk", help="Default output file types (default vtk)")
+    parser.add_argument("--pcntdfl", type=float, default=5.0, help="Default percent deflection distortion")
+    parser.add_argument("--interval", type=float, default=5.0, help="Seconds between looks at the folders")
+    parser.add_argument("--settle", type=float, default=10.0,
+                        help="Seconds a file has to stay the same size and time before it is translated")
+    parser.add_argument("--workers", type=int, default=2, help="Number of worker processes (default 2)")
+    parser.add_argument("--max-queue", type=int, default=None,
+                        help="Most files handed to the pool at once (default twice the workers)")
+    parser.add_argument("--retries", type=int, default=2, help="Times to try a failed file again (default 2)")
+    parser.add_argument("--retry-delay", type=float, default=30.0,
+                        help="Seconds before the first retry, doubled for each one after (default 30)")
+    parser.add_argument("--cache-mb", type=float, default=4096,
+                        help="Memory budget in MB for the solution cache in each worker (default 4096)")
+    parser.add_argument("--mem-cap-mb", type=float, default=None,
+                        help="Keep work arrays under this many MB per worker, spilling big ones to disk")
+    parser.add_argument("--scratch-dir", default=None,
+                        help="Folder for the work arrays that spill to disk (default is the temp folder)")
+    parser.add_argument("--dpf-server", default=None,
+                        help="host:port of a DPF server that is already running (default starts one per worker)")
+    parser.add_argument("--metrics-log", default=None,
+                        help="Add the time and memory of every stage of every job to this file as JSON lines")
+    parser.add_argument("--stats-every", type=float, default=60.0, help="Seconds between stats lines")
+    parser.add_argument("--stats-file", default=None, help="Also write the latest stats to this JSON file")
+    parser.add_argument("--once", action="store_true",
+                        help="Stop when every file in the folders has been translated")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Print the full translation messages from every job")
+    args = parser.parse_args(argv)
+    defaults = {"sets":args.sets, "types":args.types, "formats":args.formats, "pcntdfl":args.pcntdfl, 
+                "outroot":None, "quantize":False, "lod":None, "scaleMode":"set", 
+                "colormap":"rainbow", "colorRange":None, "averageBodies":False}
+    dirs = [os.path.abspath(d) for d in args.dirs]
+    for d in dirs:
+        if not os.path.isdir(d):
+            parser.error("Folder not found: " + d)
+        try:
+            loadRecipe(d,defaults)
+        except Exception as exc:
+            parser.error("Bad recipe for " + d + ": " + str(exc))
+    workers = max(1, args.workers)
+    maxQueue = args.max_queue or 2*workers
+    exportOptions.update({"memCapMB":args.mem_cap_mb, "scratchDir":args.scratch_dir, "dpfServer":args.dpf_server,
+                          "metricsLog":os.path.abspath(args.metrics_log) if args.metrics_log else None})
+
+    print("===========================================================================")
+    print("Watching " + str(len(dirs)) + " folder(s) with " + str(workers) + " worker(s), Ctrl-C to stop")
+    for d in dirs:
+        print("  " + d)
+    print("---------------------------------------------------------------------------", flush=True)
+
+# 19.5.1: What we know about each file: its last size and time, when it last changed, the size 
+#         and time we last translated, how many times it has failed, and when it can try again
+    files = {}
+    pending = deque()
+    inflight = {}
+    badRecipes = {}
+    stats = {"started":time.perf_counter(), "seen":0, "queued":0, "done":0, "failed":0, "retries":0, 
+             "made":0, "skipped":0}
+    lastStats = time.perf_counter()
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=initBatchWorker, 
+                               initargs=(args.verbose,args.cache_mb,exportOptions))
+    interrupted = False
+    try:
+        while True:
+            now = time.perf_counter()
+
+# 19.5.2: Look at every folder. A new or changed file starts its settle time over
+            for d in dirs:
+                try:
+                    recipe = loadRecipe(d,defaults)
+                    badRecipes.pop(d, None)
+                except Exception as exc:
+                    if badRecipes.get(d) != str(exc):
+                        print("Bad recipe for " + d + ", skipping it: " + str(exc), flush=True)
+                    badRecipes[d] = str(exc)
+                    continue
+                for name in sorted(os.listdir(d)):
+                    path = os.path.join(d,name)
+                    if not name.lower().endswith(rstExts) or not os.path.isfile(path):
+                        continue
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    sig = (st.st_size, st.st_mtime_ns)
+                    rec = files.get(path)
+                    if rec is None:
+                        rec = files[path] = {"sig":sig, "since":now, "done":None, "tries":0, "retryAt":0.0}
+                        stats["seen"] += 1
+                    elif rec["sig"] != sig:
+                        rec.update(sig=sig, since=now, tries=0, retryAt=0.0)
+                    elif (now-rec["since"] >= args.settle and rec["done"] != sig and now >= rec["retryAt"] 
+                          and path not in pending and path not in inflight.values()):
+                        rec["recipe"] = recipe
+                        pending.append(path)
+                        stats["queued"] += 1
+
+# 19.5.3: Hand files to the pool until it has max-queue of them
+            while len(pending) > 0 and len(inflight) < maxQueue:
+                path = pending.popleft()
+                rec = files[path]
+                rec["submitted"] = rec["sig"]
+                inflight[pool.submit(runWatchJob, {"rstPath":path, "recipe":rec["recipe"]})] = path
+
+# 19.5.4: Wait for something to finish, or for the next look at the folders
+            finished, notDone = wait(list(inflight), timeout=args.interval, return_when=FIRST_COMPLETED)
+            if len(inflight) == 0:
+                time.sleep(args.interval)
+            for fut in finished:
+                path = inflight.pop(fut)
+                rec = files[path]
+                try:
+                    res = fut.result()
+                except Exception as exc:
+                    res = {"ok":False, "error":type(exc).__name__ + ": " + str(exc), "secs":0.0, 
+                           "sets":0, "made":0, "skipped":0}
+                stats["made"] += res["made"]
+                stats["skipped"] += res["skipped"]
+                if res["ok"]:
+                    rec["done"] = rec["submitted"]
+                    stats["done"] += 1
+                    print("ok    %7.1fs  %d set(s), %d file(s) made  %s" % (res["secs"], res["sets"], res["made"], path), 
+                          flush=True)
+                elif rec["tries"] < args.retries:
+                    rec["tries"] += 1
+                    rec["retryAt"] = time.perf_counter() + args.retry_delay*2**(rec["tries"]-1)
+                    stats["retries"] += 1
+                    print("retry %d/%d in %.0fs  %s: %s" % (rec["tries"], args.retries, 
+                          args.retry_delay*2**(rec["tries"]-1), path, res["error"]), flush=True)
+                else:
+                    rec["done"] = rec["submitted"]
+                    stats["failed"] += 1
+                    print("FAIL  %s: %s" % (path, res["error"]), flush=True)
+
+# 19.5.5: The stats, every so often
+            if time.perf_counter() - lastStats >= args.stats_every:
+                lastStats = time.perf_counter()
+                st = watchStats(stats,pending,inflight,workers)
+                print(statsLine(st), flush=True)
+                if args.stats_file is not None:
+                    with open(args.stats_file,"w") as fh:
+                        json.dump(st, fh, indent=1)
+
+            if args.once and len(pending) == 0 and len(inflight) == 0 and \
+               all(rec["done"] == rec["sig"] for rec in files.values()):
+                break
+    except KeyboardInterrupt:
+        print("Stopping, " + str(len(inflight)) + " file(s) in the pool are dropped", flush=True)
+        interrupted = True
+    finally:
+        pool.shutdown(wait=not interrupted, cancel_futures=True)
+
+    st = watchStats(stats,pending,inflight,workers)
+    print("===========================================================================")
+    print(statsLine(st))
+    if args.stats_file is not None:
+        with open(args.stats_file,"w") as fh:
+            json.dump(st, fh, indent=1)
+    print("===========================================================================", flush=True)
+    if stats["failed"] > 0:
+        return 1
+    return 0
+#
+# End of Section 19
+
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#
+#  ##### SECTION 20 #####
+#
+#  The translation service. Some of our other tools need a translated file now and then, and 
+#    each one was starting this whole script, which means importing DPF and starting a DPF server 
+#    every time. In serve mode we stay running as a small web server on this computer, so the 
+#    tools share one warm process and the solutions stay in the cache (Section 7) between requests. 
+#
+#    Example: 
+#       python Ansys_3D_Result_Translator.py serve --port 8765
+#       curl -d '{"rstFile":"C:/runs/file.rst","rstnum":2,"rsttype":"seqv","outtype":"glb"}' localhost:8765/translate
+#
+#    - POST /translate takes the same values as the GUI, as JSON or as ?name=value in the URL:
+#        rstFile, rstnum, rsttype, pcntdfl (5), outtype (vtk, a comma list is fine), outroot 
+#        (the result file name), quantize, lod, scaleMode, colormap, colorRange (like "0,250"), 
+#        averageBodies, force, and stream
+#      It answers with JSON that has the output file names. With stream set it sends back the 
+#      bytes of the file instead, which needs the request to make just one file
+#    - GET /status answers with the request counts and what is in the cache
+#    - --socket serves on a Unix socket instead of a port, for tools on the same machine
+#    - Two requests for the same thing at the same time are only translated once, the second 
+#      one waits for the first and gets the same answer
+#    - The translations run one at a time on one worker thread, since exportOptions and the DPF 
+#      server are shared by the whole process. Writing several formats still runs in parallel (5.12.6)
+#
+# 20.1: The file names for an output root (the path without the extension), the output types, 
+#       and the levels of detail (Section 17). Returns an ordered dictionary of 
+#       label: (type, level, file name), with None for the level of the full surface. 
+#       The surface types get "-lod1", "-lod2", ... on the name for each level that is not "full". 
+#       Binary STL files end in "-bin.stl", since slicers and viewers only know STL by .stl, and 
+#       the -bin keeps them apart from the text STL
+outputExts = {"stlb":"-bin.stl"}
+
+def outputFiles(outpath,outtypes,lod):
+    levels = lod or ["full"]
+    outFiles = OrderedDict()
+    for ot in outtypes:
+        if ot == "none":
+            continue
+        ext = outputExts.get(ot, "."+ot)
+        if ot not in ("obj","wrl","stl","stlb","glb"):
+            outFiles[ot] = (ot, None, outpath+ext)
+            continue
+        k = 0
+        for level in levels:
+            if level == "full":
+                outFiles[ot] = (ot, None, outpath+ext)
+            else:
+                k += 1
+                outFiles[ot+"-lod"+str(k)] = (ot, level, outpath+"-lod"+str(k)+ext)
+    return outFiles
+
+# 20.2: Check the values of a request and fill in the defaults, the same checks doTranslate() 
+#       does for the GUI. Raises ValueError with what is wrong. Values from the URL come in as 
+#       strings, so everything is converted here. Values from JSON can be any type, so the type 
+#       of each one is checked first, and a list, a number, or an object where text should be 
+#       is a ValueError too (the client gets a 400, not a dropped connection)
+serveKeys = ("rstFile","rstnum","rsttype","pcntdfl","outtype","outroot","quantize","lod","scaleMode",
+             "colormap","colorRange","averageBodies","force","stream")
+contentTypes = {"vtk":"application/octet-stream", "obj":"model/obj", "stl":"model/stl", 
+                "wrl":"model/vrml", "glb":"model/gltf-binary"}
+
+def serveRequest(params):
+    def flag(val):
+        if not isinstance(val,(str,int,float)):
+            raise ValueError("a yes/no value has to be true, false, 1, or 0")
+        return str(val).lower() in ("1","true","yes","on")
+    def text(name,default,listOk=False):
+        val = params.get(name,default)
+        if listOk and isinstance(val,list) and all(isinstance(v,(str,int,float)) and not isinstance(v,bool) for v in val):
+            val = ",".join(str(v) for v in val)
+        if not isinstance(val,str) and not (val is None and default is None):
+            raise ValueError(name + " has to be text" + (" or a list" if listOk else ""))
+        return val
+    def number(name,default,types):
+        val = params.get(name,default)
+        if isinstance(val,bool) or not isinstance(val,types+(str,)):
+            raise ValueError(name + " has to be a number")
+        return val
+    bad = [k for k in params if k not in serveKeys]
+    if len(bad) > 0:
+        raise ValueError("Unknown value(s): " + ", ".join(bad))
+    rstFile = text("rstFile",None)
+    if rstFile is None or not os.path.isfile(rstFile):
+        raise ValueError("rstFile has to be a result file that exists")
+    req = {"rstFile":os.path.abspath(rstFile)}
+    try:
+        req["rstnum"] = int(number("rstnum",1,(int,)))
+        req["pcntdfl"] = float(number("pcntdfl",5.0,(int,float)))
+    except (TypeError,ValueError):
+        raise ValueError("rstnum has to be a whole number and pcntdfl a number")
+    if req["rstnum"] < 1:
+        raise ValueError("rstnum starts at 1")
+    req["rsttype"] = text("rsttype","usum")
+    if req["rsttype"] not in rsttype_list:
+        raise ValueError("rsttype has to be one of " + ", ".join(rsttype_list))
+    try:
+        req["outtype"] = parseNameList(text("outtype","vtk",True),outtype_list,"output file type")
+        lod = text("lod",None,True)
+        req["lod"] = (parseLodList(lod) or None) if lod else None
+        colorRange = text("colorRange",None,True)
+        req["colorRange"] = parseColorRange(colorRange) if colorRange else None
+    except argparse.ArgumentTypeError as exc:
+        raise ValueError(str(exc))
+    if len(req["outtype"]) == 0:
+        raise ValueError("outtype is empty")
+    if req["rsttype"] == "all" and any(ot not in ("vtk","none") for ot in req["outtype"]):
+        raise ValueError("the all result type needs vtk")
+    req["outroot"] = text("outroot",None) or os.path.splitext(os.path.basename(req["rstFile"]))[0]
+    if os.path.basename(req["outroot"]) != req["outroot"]:
+        raise ValueError("outroot is a file name, not a path")
+    req["scaleMode"] = text("scaleMode","set")
+    if req["scaleMode"] not in ("set","global"):
+        raise ValueError("scaleMode has to be set or global")
+    req["colormap"] = text("colormap","rainbow")
+    if req["colormap"] not in colorMaps:
+        raise ValueError("colormap has to be one of " + ", ".join(sorted(colorMaps)))
+    req["averageBodies"] = flag(params.get("averageBodies",False))
+    req["quantize"] = flag(params.get("quantize",False))
+    req["force"] = flag(params.get("force",False))
+    req["stream"] = flag(params.get("stream",False))
+    req["files"] = outputFiles(os.path.join(os.path.dirname(req["rstFile"]),
+                               req["outroot"]+"-"+req["rsttype"]+"-"+str(req["rstnum"])),req["outtype"],req["lod"])
+    if req["stream"] and len(req["files"]) != 1:
+        raise ValueError("stream needs a request that makes just one file")
+    return req
+
+# 20.3: Requests that make the same files are the same request, however the client sent them. 
+#       stream is left out since it only changes how the answer is sent
+def requestKey(req):
+    return json.dumps([req[k] for k in serveKeys if k != "stream"])
+
+# 20.4: Run one request, on the worker thread. Returns what goes back to the client. 
+#       A set or result that is not on the file is a LookupError, which the client gets as a 404
+def runServeJob(req):
+    start = time.perf_counter()
+    exportOptions.update({"quantize":req["quantize"], "lod":req["lod"], "scaleMode":req["scaleMode"], 
+                          "scaleSets":None, "fixedUmax":None, "force":req["force"], "colormap":req["colormap"],
+                          "colorRange":req["colorRange"], "averageBodies":req["averageBodies"]})
+    metrics = StageMetrics({"rstFile":os.path.basename(req["rstFile"]), "rstnum":req["rstnum"], 
+                            "rsttype":req["rsttype"], "outtype":",".join(req["outtype"])})
+    if not createResultFile(req["rstnum"],req["pcntdfl"],req["rsttype"],os.path.basename(req["rstFile"]),
+                            os.path.dirname(req["rstFile"]),req["outtype"],req["outroot"],0,metrics):
+        raise LookupError("result " + req["rsttype"] + " not found for set " + str(req["rstnum"]))
+    check = metrics.get("manifest")
+    return {"ok":True, "files":[fname for ot, level, fname in req["files"].values()], 
+            "made":filesMade(metrics.records), "upToDate":check["skipped"], "secs":time.perf_counter()-start,
+            "stages":dict((rec["stage"],rec["wallSecs"]) for rec in metrics.records)}
+
+# 20.5: The service. inflight has a future for each request being translated, by requestKey(), 
+#       which is how a second request for the same thing finds the first one
+class TranslateService:
+
+    def __init__(self):
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.inflight = {}
+        self.stats = {"started":time.time(), "requests":0, "translations":0, "coalesced":0, 
+                      "failed":0, "bytesStreamed":0}
+
+# 20.5.1: Translate a request, or wait for the same one that is already going. The future is 
+#         shielded so a client that hangs up does not cancel it for the others waiting on it
+    async def translate(self,req):
+        key = requestKey(req)
+        fut = self.inflight.get(key)
+        if fut is None:
+            fut = asyncio.get_running_loop().run_in_executor(self.pool, runServeJob, req)
+            self.inflight[key] = fut
+            fut.add_done_callback(lambda f: self.inflight.pop(key, None))
+            self.stats["translations"] += 1
+            coalesced = False
+        else:
+            self.stats["coalesced"] += 1
+            coalesced = True
+        res = dict(await asyncio.shield(fut))
+        res["coalesced"] = coalesced
+        return res
+
+    def status(self):
+        st = dict(self.stats)
+        st.update({"inFlight":len(self.inflight), "cache":solCache.summary(), "dpfAddress":dpfState["address"],
+                   "uptimeSecs":time.time()-self.stats["started"]})
+        return st
+
+# 20.5.2: One connection. Read the request line, the headers, and the body, answer, and close. 
+#         This is just enough HTTP for curl, requests, and fetch() on the same machine
+    async def handle(self,reader,writer):
+        try:
+            try:
+                line = (await reader.readline()).decode("latin-1").split()
+                headers = {}
+                while True:
+                    hdr = (await reader.readline()).decode("latin-1")
+                    if hdr in ("\r\n","\n",""):
+                        break
+                    name, sep, val = hdr.partition(":")
+                    headers[name.strip().lower()] = val.strip()
+                body = await reader.readexactly(int(headers.get("content-length",0)))
+                method, target = line[0], line[1]
+            except (IndexError,ValueError,asyncio.IncompleteReadError):
+                await self.reply(writer,400,{"ok":False, "error":"bad HTTP request"})
+                return
+            url = urllib.parse.urlsplit(target)
+            if url.path == "/status" and method == "GET":
+                await self.reply(writer,200,self.status())
+                return
+            if url.path != "/translate" or method not in ("GET","POST"):
+                await self.reply(writer,404,{"ok":False, "error":"use POST /translate or GET /status"})
+                return
+            self.stats["requests"] += 1
+            try:
+                params = dict(urllib.parse.parse_qsl(url.query))
+                if len(body) > 0:
+                    obj = json.loads(body.decode("utf-8"))
+                    if not isinstance(obj,dict):
+                        raise ValueError("the body has to be a JSON object of name: value")
+                    params.update(obj)
+                req = serveRequest(params)
+            except ValueError as exc:
+                await self.reply(writer,400,{"ok":False, "error":str(exc)})
+                return
+            try:
+                res = await self.translate(req)
+            except LookupError as exc:
+                self.stats["failed"] += 1
+                await self.reply(writer,404,{"ok":False, "error":str(exc)})
+                return
+            except Exception as exc:
+                self.stats["failed"] += 1
+                await self.reply(writer,500,{"ok":False, "error":type(exc).__name__ + ": " + str(exc)})
+                return
+            if req["stream"]:
+                await self.sendFile(writer,res)
+            else:
+                await self.reply(writer,200,res)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+# 20.5.3: Send a JSON answer
+    async def reply(self,writer,code,obj):
+        data = json.dumps(obj, default=str).encode("utf-8")
+        writer.write(("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n"
+                      "Connection: close\r\n\r\n" % (code, {200:"OK",400:"Bad Request",404:"Not Found",
+                      500:"Internal Server Error"}[code], len(data))).encode("latin-1"))
+        writer.write(data)
+        await writer.drain()
+
+# 20.5.4: Send the bytes of the one file, a MB at a time, so a big file is never all in memory. 
+#         The headers say which file it was and whether it was made or was already up to date
+    async def sendFile(self,writer,res):
+        fname = res["files"][0]
+        size = os.path.getsize(fname)
+        ext = os.path.splitext(fname)[1][1:]
+        writer.write(("HTTP/1.1 200 OK\r\nContent-Type: %s\r\nContent-Length: %d\r\n"
+                      "Content-Disposition: attachment; filename=\"%s\"\r\nX-Output-File: %s\r\n"
+                      "X-Up-To-Date: %d\r\nConnection: close\r\n\r\n" % (contentTypes.get(ext,"application/octet-stream"), 
+                      size, os.path.basename(fname), urllib.parse.quote(fname), res["upToDate"])).encode("latin-1"))
+        with open(fname,"rb") as fh:
+            while True:
+                chunk = fh.read(1<<20)
+                if len(chunk) == 0:
+                    break
+                writer.write(chunk)
+                self.stats["bytesStreamed"] += len(chunk)
+                await writer.drain()
+
+# 20.6: The serve main program. Start DPF on the worker thread so the first request does not wait 
+#       for it, then serve until Ctrl-C
+def runServe(argv):
+    global tzEcho
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(sys.argv[0]) + " serve",
+        description="Run a local service that translates Ansys result files on request"
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default 8765)")
+    parser.add_argument("--socket", default=None, help="Listen on this Unix socket instead of a port")
+    parser.add_argument("--cache-mb", type=float, default=4096,
+                        help="Memory budget in MB for the solution cache (default 4096)")
+    parser.add_argument("--mem-cap-mb", type=float, default=None,
+                        help="Keep the work arrays under this many MB (Section 14)")
+    parser.add_argument("--dpf-server", default=None, help="host:port of a DPF server that is already running")
+    parser.add_argument("--metrics-log", default=None, help="Add the stage timings to this file as lines of JSON")
+    parser.add_argument("--verbose", action="store_true", help="Print the translation messages")
+    args = parser.parse_args(argv)
+    tzEcho = args.verbose
+    solCache.setBudget(args.cache_mb)
+    exportOptions.update({"memCapMB":args.mem_cap_mb, "dpfServer":args.dpf_server, "metricsLog":args.metrics_log})
+    service = TranslateService()
+    service.pool.submit(warmDpf)
+
+    async def serve():
+        if args.socket is not None:
+            server = await asyncio.start_unix_server(service.handle, path=args.socket)
+            where = args.socket
+        else:
+            server = await asyncio.start_server(service.handle, host=args.host, port=args.port)
+            where = "http://%s:%d" % (args.host, server.sockets[0].getsockname()[1])
+        print("Translation service on " + where + ", Ctrl-C to stop", flush=True)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.pool.shutdown(wait=True)
+        stopDpf()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
+    print("Stopped after " + str(service.stats["requests"]) + " request(s)", flush=True)
+    return 0
+#
+# End of Section 20
+
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#
+#  ##### SECTION 21 #####
+#
+#  Averaging elemental results to the nodes. Stress and strain come per element, but the surface 
+#    files need a value at each point. We used to average the faces around each surface point, 
+#    which left out the elements inside the model, and counted elements with no result as zero. 
+#    Now the average is over every element that uses the node, the same as averaged results in 
+#    Mechanical, and elements with no result are left out.
+#
+#    The elements around each node only depend on the mesh, so they are worked out once as a 
+#    sparse matrix with a 1 for each (node, element) pair and kept with the mesh in the solution 
+#    cache (Section 7). After that, averaging a set is one multiply of the matrix with the values 
+#    and a "has a value" column. scipy does the sparse multiply if it is installed, if not it is 
+#    done with np.bincount from the same pairs
+#
+#    With exportOptions["averageBodies"], values are not averaged across the boundary between two 
+#    bodies (material numbers). A node on a boundary takes the average of the body with the most 
+#    elements at that node, so a stiff part does not pull down the stress of a soft one next to it
+#
+# 21.1: A range for the colors from a string like "0,250" (Section 11)
+def parseColorRange(theStr):
+    try:
+        if isinstance(theStr,str):
+            vals = [float(v) for v in theStr.split(",")]
+        else:
+            vals = [float(v) for v in theStr]
+    except (TypeError,ValueError):
+        raise argparse.ArgumentTypeError("color range has to be two numbers, min,max")
+    if len(vals) != 2 or not vals[1] > vals[0]:
+        raise argparse.ArgumentTypeError("color range has to be two numbers, min,max, with min < max")
+    return (vals[0], vals[1])
+
+# 21.2: The body (material number) of each element, in element order, or None if the mesh 
+#       does not have them
+def elementBodies(mymesh):
+    try:
+        mats = np.asarray(mymesh.elements.materials_field.data, dtype=np.int64)
+    except Exception:
+        return None
+    if len(mats) != mymesh.elements.n_elements:
+        return None
+    return mats
+
+# 21.3: The (node, element) pairs of the mesh, from the connectivity of the grid. A node that shows 
+#       up twice in one element (a wedge made from a brick) only counts once. With bodies, the pairs 
+#       of the other bodies at a boundary node are dropped
+def averagingPairs(mymesh,bodies):
+    grid = mymesh.grid
+    offsets = np.asarray(grid.cell_offsets, dtype=np.int64)
+    ncell = len(offsets) - 1
+    cells = np.repeat(np.arange(ncell, dtype=np.int64), np.diff(offsets))
+    key = np.unique(np.asarray(grid.cell_connectivity, dtype=np.int64)*ncell + cells)
+    nodes, cells = np.divmod(key, ncell)
+    del key
+    mats = elementBodies(mymesh) if bodies else None
+    if mats is not None:
+        bodyIds, body = np.unique(mats, return_inverse=True)
+        nbody = len(bodyIds)
+        pairs, count = np.unique(nodes*nbody + body[cells], return_counts=True)
+        pnode, pbody = np.divmod(pairs, nbody)
+        order = np.lexsort((pbody, -count, pnode))[::-1]
+        owner = np.full(grid.n_points, -1, dtype=np.int64)
+        owner[pnode[order]] = pbody[order]
+        keep = body[cells] == owner[nodes]
+        nodes, cells = nodes[keep], cells[keep]
+    return nodes, cells, grid.n_points, ncell
+
+# 21.4: The averaging matrix of a cache entry, made the first time it is asked for. 
+#       As the three arrays of a scipy CSR matrix, so the cache can count its memory, 
+#       or as the node and element of each pair if there is no scipy
+def averagingMatrix(cached,bodies):
+    def makeIt():
+        nodes, cells, nnode, ncell = averagingPairs(cached["mesh"],bodies)
+        try:
+            import scipy.sparse
+        except ImportError:
+            return {"nodes":nodes, "cells":cells, "shape":np.array([nnode,ncell])}
+        mat = scipy.sparse.csr_matrix((np.ones(len(nodes)), (nodes, cells)), shape=(nnode,ncell))
+        return {"data":mat.data, "indices":mat.indices, "indptr":mat.indptr, "shape":np.array([nnode,ncell])}
+    return solCache.derived(cached,"average-bodies" if bodies else "average",makeIt)
+
+# 21.5: Average elemental values (one per element, NaN for no result) to the nodes. 
+#       Nodes with no elements that have a result come back NaN
+def elementalToNodal(vals,cached):
+    avg = averagingMatrix(cached,bool(exportOptions["averageBodies"]))
+    good = np.isfinite(vals)
+    both = np.column_stack([np.where(good,vals,0.0), good.astype(np.float64)])
+    if "indptr" in avg:
+        import scipy.sparse
+        mat = scipy.sparse.csr_matrix((avg["data"],avg["indices"],avg["indptr"]), shape=tuple(avg["shape"]))
+        sums = mat @ both
+    else:
+        sums = np.column_stack([np.bincount(avg["nodes"], weights=both[avg["cells"],k], minlength=avg["shape"][0])
+                                for k in (0,1)])
+    nodal = np.full(len(sums), np.nan)
+    np.divide(sums[:,0], sums[:,1], out=nodal, where=sums[:,1] > 0)
+    return nodal
+#
+# End of Section 21
 
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
@@ -445,101 +3395,164 @@ def createResultFile(rstnum,pcntdfl,rsttype,rstFile,rstDir,outtype,outroot,doPlo
 #     Since we have a GUI, the main program simply builds and launches the GUI
 #     Then the actual actions to view and write results out happen when the 
 #     User presses the "translate" button
+#     If there are arguments on the command line we skip the GUI and run in 
+#     batch mode instead (Section 6)
+#
+#     The GUI is built inside launchGUI() so that the batch worker processes 
+#     can import this file without opening a window
+
+def launchGUI():
+    global myDialog, frm1, textZone, filename_lbl, rstFile
+    global rstNum, pcntdfl, rsttype, outtype, alsoOut, outroot, doPlot, doQuant, doGlobal, memCap, lodLvls
+    global doForce
+    global progVar, statusLbl
+
+    #2.1: We use a call to TK to open a window (dialog) and we give it some
+    #       parameters to make it look like we want. 
+    #       NOTE: TK uses this row column format to place items
+
+    myDialog = Tk()
+    myDialog.title("PADT's Ansys Result to 3D Files")
+    myDialog.geometry('950x560')
+    myDialog.columnconfigure(0, weight=1)
+    myDialog.rowconfigure(0, weight=1)
+
+    #2.2: The widgets go into a frame, so make that.  
+    #     frm1 is a global variable and we will us it to back the window with
+    #     our various input widgets
+    frm1 = ttk.Frame(myDialog, padding="10 10 10 10")
+    frm1.grid(column=0, row=0, sticky=(N, W, E, S))
+
+    #2.3: To keep things cleaner, we use a function called bldInput() (Section 3)
+    #     to create text input widgets.
+    #     Feed it the variable we want the input to go into, the text we want
+    #     for the lable, and what row number we want to place it in. 
+    #     Build input for the result set number and % deflection.
+    rstNum = StringVar()
+    bldInput(rstNum,"Result Set Number:",1)
+
+    pcntdfl = StringVar()
+    bldInput(pcntdfl,"Percent Deflection Distortion:",2)
+
+    # 2.4: Now we need a drop down
+    #      Again, we are going to use a function, bldDrop()
+    #      It takes the variable to fill, the lable text, a list of strings, 
+    #      and the row number
+    #      To allign you use "sticky" with N, S, E, W to specify where in the cell to allign
+    #      Build a dropdown for the result type and the output format 
+    rsttype = StringVar()
+    bldDrop(rsttype,"Result Type:",rsttype_list,3)
+
+    outtype = StringVar()
+    bldDrop(outtype,"Output File Type:",outtype_list,4)
+
+    #2.5: Use bldInput() to create a text input widget for the output file root
+    outroot = StringVar()
+    bldInput(outroot,"Output File Root:",5)
+
+    #2.5.1: The options go down the right side in columns 4 and 5
+    #       The memory cap can be left blank for no cap (Section 14)
+    memCap = StringVar()
+    bldInput(memCap,"Memory Cap (MB):",1,4)
+
+    #2.5.2: More output types to write along with the one in the dropdown, like "stl,glb". 
+    #       They all come from one read of the results (Section 5)
+    alsoOut = StringVar()
+    bldInput(alsoOut,"Also Write Types:",4,4)
+
+    #2.5.3: Levels of detail for the surface files, like "full,50k" (Section 17). Blank for just full
+    lodLvls = StringVar()
+    bldInput(lodLvls,"LOD Levels:",2,4)
+
+    # 2.6: We only have a few checkboxes, so no need for a function
+    #      Just build it and put it in row 6
+    #      Set the variable, doPlot to 1 so the default is "yes"
+    doPlot = IntVar(value=1)
+    doPlotChk = ttk.Checkbutton(frm1, text = "Plot First", variable=doPlot )
+    doPlotChk.grid(column=3, row=6, sticky=W)
+
+    #2.6.1: A second checkbox next to it to make smaller GLB files
+    doQuant = IntVar(value=0)
+    ttk.Checkbutton(frm1, text = "Quantize GLB", variable=doQuant ).grid(column=4, row=6, sticky=W)
+
+    #2.6.2: And one to scale every set by the biggest deflection on the file (Section 8)
+    doGlobal = IntVar(value=0)
+    ttk.Checkbutton(frm1, text = "Same Scale All Sets", variable=doGlobal ).grid(column=5, row=6, sticky=W)
+
+    #2.6.3: Files that are up to date with their manifest are not written again (Section 18), 
+    #       unless this is checked
+    doForce = IntVar(value=0)
+    ttk.Checkbutton(frm1, text = "Rebuild Up To Date Files", variable=doForce ).grid(column=5, row=5, sticky=W)
+
+    # 2.7: To specify the result file, we are going to open up a file dialog and let the user 
+    #      define the file. This gets a bit fancy
+
+    # 2.7.1: Get the label on there in column 2, row 7
+    ll = ttk.Label(frm1, text="Ansys Result File:").grid(column=2, row=7,sticky=E)
+
+    # 2.7.2: Now make a button that executes the "select_file" command 
+    open_button = ttk.Button(frm1, text='Specify Result File', command=select_file)
+    open_button.grid(column=3, row=7, sticky=W)
+
+    # 2.7.3: Once the user does pick a file, we want to show their choice, so make a text label 
+    #        and leave it blank
+    rstFile = StringVar()
+    filename_lbl = ttk.Label(frm1, text="   ",wraplength=250)
+    filename_lbl.grid(column=3, row=8, sticky=W, columnspan=2)
+    #------
+
+    #2.8: Now we need the OK/Cancel buttons, but we will use "translate" and "close"
+    #     Very simple, they got to two functions, doTranslate and closeIt
+    #     Translate puts a job on the queue (Section 9), and Cancel stops the running and queued jobs
+    ttk.Button(frm1, width=-10, text="Translate", command=doTranslate).grid(column=3, row=9, sticky=W)
+    ttk.Button(frm1, text="Cancel", command=cancelJobs).grid(column=4, row=9, sticky=W)
+    ttk.Button(frm1, text="Close", command=closeIt).grid(column=5, row=9, sticky=W)
+
+    #2.9: We want to give some feedback to the user as we run
+    #     This is old school, but we are going to make a scrolled text region and print out messages
+    #     to that widget like we would to the command line. 
+    #     we will use a function, tzPrint() to output to this zone
+    textZone = scrolledtext.ScrolledText(frm1,width = 80, height = 8)
+    textZone.grid(column=2,row=10, columnspan=4, pady=10, padx = 10)
+
+    #2.9.1: Under the text zone, a progress bar for the running job and a status line 
+    #       that shows what is running and how many jobs are waiting
+    progVar = DoubleVar(value=0)
+    ttk.Progressbar(frm1, variable=progVar, maximum=100, length=560).grid(column=2, row=11, columnspan=4)
+    statusLbl = ttk.Label(frm1, text="Status: idle")
+    statusLbl.grid(column=2, row=12, columnspan=4, sticky=W)
+
+    #2.10: To make everything not look so crowded, add 5px of padding to every widget we just made. 
+    for child in frm1.winfo_children(): 
+        child.grid_configure(padx=5, pady=5)
+
+    #2.11: If the user presses return, then do the translation
+    myDialog.bind("<Return>", doTranslate)
+
+    #2.12: Use tzPrint to output our first messages. 
+    tzPrint(textZone,"+++ Initialized +++")
+    tzPrint(textZone,"Please fill out every field")
+
+    #2.13: Finaly!  We are ready to go, start checking for messages from the background 
+    #      translations (Section 9), start DPF in the background (Section 16), 
+    #      launch the window and wait for input from the user. 
+    myDialog.after(100,pollMessages)
+    threading.Thread(target=warmDpf, name="warmDpf", daemon=True).start()
+    myDialog.mainloop()
+#
+# End of launchGUI()
+
+#2.14: This is where the program actually starts. No arguments means the user wants the GUI,
+#      "watch" watches folders for new result files (Section 19), "serve" runs the translation 
+#      service (Section 20), anything else gets handed to the batch mode in Section 6
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "watch":
+        sys.exit(runWatch(sys.argv[2:]))
+    elif len(sys.argv) > 1 and sys.argv[1] == "serve":
+        sys.exit(runServe(sys.argv[2:]))
+    elif len(sys.argv) > 1:
+        sys.exit(runBatch(sys.argv[1:]))
+    else:
+        launchGUI()
 
-#2.1: We use a call to TK to open a window (dialog) and we give it some
-#       parameters to make it look like we want. 
-#       NOTE: TK uses this row column format to place items
-
-myDialog = Tk()
-myDialog.title("PADT's Ansys Result to 3D Files")
-myDialog.geometry('750x500')
-myDialog.columnconfigure(0, weight=1)
-myDialog.rowconfigure(0, weight=1)
-
-#2.2: The widgets go into a frame, so make that.  
-#     frm1 is a global variable and we will us it to back the window with
-#     our various input widgets
-frm1 = ttk.Frame(myDialog, padding="10 10 10 10")
-frm1.grid(column=0, row=0, sticky=(N, W, E, S))
-
-#2.3: To keep things cleaner, we use a function called bldInput() (Section 3)
-#     to create text input widgets.
-#     Feed it the variable we want the input to go into, the text we want
-#     for the lable, and what row number we want to place it in. 
-#     Build input for the result set number and % deflection.
-rstNum = StringVar()
-bldInput(rstNum,"Result Set Number:",1)
-
-pcntdfl = StringVar()
-bldInput(pcntdfl,"Percent Deflection Distortion:",2)
-
-# 2.4: Now we need a drop down
-#      Again, we are going to use a function, bldDrop()
-#      It takes the variable to fill, the lable text, a list of strings, 
-#      and the row number
-#      To allign you use "sticky" with N, S, E, W to specify where in the cell to allign
-#      Build a dropdown for the result type and the output format 
-rsttype = StringVar()
-rsttype_list = ('u','ux','uy','uz','usum','sx','sy','sz','s1','s2','s3','seqv','tmp')
-bldDrop(rsttype,"Result Type:",rsttype_list,3)
-
-outtype = StringVar()
-outtype_list = ('vtk','obj','stl','wrl','none')
-bldDrop(outtype,"Output File Type:",outtype_list,4)
-
-#2.5: Use bldInput() to create a text input widget for the output file root
-outroot = StringVar()
-bldInput(outroot,"Output File Root:",5)
-
-# 2.6: We only have one checkbox, so no need for a function
-#      Just build it and put it in row 6
-#      Set the variable, doPlot to 1 so the default is "yes"
-doPlot = IntVar(value=1)
-doPlotChk = ttk.Checkbutton(frm1, text = "Plot First", variable=doPlot )
-doPlotChk.grid(column=3, row=6, sticky=W)
-
-# 2.7: To specify the result file, we are going to open up a file dialog and let the user 
-#      define the file. This gets a bit fancy
-
-# 2.7.1: Get the label on there in column 2, row 7
-ll = ttk.Label(frm1, text="Ansys Result File:").grid(column=2, row=7,sticky=E)
-
-# 2.7.2: Now make a button that executes the "select_file" command 
-open_button = ttk.Button(frm1, text='Specify Result File', command=select_file)
-open_button.grid(column=3, row=7, sticky=W)
-
-# 2.7.3: Once the user does pick a file, we want to show their choice, so make a text label 
-#        and leave it blank
-rstFile = StringVar()
-filename_lbl = ttk.Label(frm1, text="   ",wraplength=250)
-filename_lbl.grid(column=3, row=8, sticky=W, columnspan=2)
-#------
-
-#2.8: Now we need the two OK/Cancel buttons, but we will use "translate" and "close"
-#     Very simple, they got to two functions, doTranslate and closeIt
-ttk.Button(frm1, width=-10, text="Translate", command=doTranslate).grid(column=3, row=9, sticky=W)
-ttk.Button(frm1, text="Close", command=closeIt).grid(column=4, row=9, sticky=W)
-
-#2.9: We want to give some feedback to the user as we run
-#     This is old school, but we are going to make a scrolled text region and print out messages
-#     to that widget like we would to the command line. 
-#     we will use a function, tzPrint() to output to this zone
-textZone = scrolledtext.ScrolledText(frm1,width = 80, height = 8)
-textZone.grid(column=2,row=10, columnspan=4, pady=10, padx = 10)
-
-
-#2.10: To make everything not look so crowded, add 5px of padding to every widget we just made. 
-for child in frm1.winfo_children(): 
-    child.grid_configure(padx=5, pady=5)
-
-#2.11: If the user presses return, then do the translation
-myDialog.bind("<Return>", doTranslate)
-
-#2.12: Use tzPrint to output our first messages. 
-tzPrint(textZone,"+++ Initialized +++")
-tzPrint(textZone,"Please fill out every field")
-
-#2.13: Finaly!  We are ready to go, launch the window and wait for input from the user. 
-myDialog.mainloop()
-
-#------------------ End of program
\ No newline at end of file
+#------------------ End of program
\ No newline at end of file